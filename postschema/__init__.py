@@ -4,7 +4,7 @@ import os
 from contextlib import suppress
 from copy import deepcopy
 from dataclasses import dataclass, field
-from functools import lru_cache
+from functools import lru_cache, partial
 from glob import glob
 from hashlib import md5
 from importlib import import_module
@@ -21,17 +21,21 @@ import pytz
 from aiojobs.aiohttp import setup as aiojobs_setup
 from aiohttp.web_urldispatcher import UrlDispatcher
 from cryptography.fernet import Fernet
+from psycopg2.extensions import make_dsn
 
-DEFAULT_TZ = os.environ.get("DEFAULT_TZ", 'UTC')
-local_tz = pytz.timezone(DEFAULT_TZ)
-
+from . import exceptions as post_exceptions
 from .commons import Commons
+from .db import InstrumentedPool
 from .core import build_app
 from .decorators import auth
 from .logging import setup_logging
+from .metrics import InstrumentedRedis
 from .schema import PostSchema, _schemas as registered_schemas # noqa
 from .utils import generate_random_word, json_response, dumps
 
+DEFAULT_TZ = os.environ.get("DEFAULT_TZ", 'UTC')
+local_tz = pytz.timezone(DEFAULT_TZ)
+
 THIS_DIR = Path(__file__).parent
 BASE_DIR = THIS_DIR  # / "postschema"
 Q_PATTERN = BASE_DIR / "sql" / "queries" / "*.sql"
@@ -50,7 +54,7 @@ THIS_DIR = Path(__file__).parent
 AUTH_TEMPLATES_DIR = THIS_DIR / 'auth' / 'templates'
 ROLES = []
 
-ALLOWED_OPERATIONS = ['post', 'patch', 'put', 'delete', 'get', 'list']
+ALLOWED_OPERATIONS = ['post', 'post_many', 'patch', 'put', 'delete', 'get', 'list', 'export']
 
 
 async def default_send_sms(*args):
@@ -58,32 +62,67 @@ async def default_send_sms(*args):
 
 
 async def cleanup(app):
+    if app.commons.session_cache is not None:
+        await app.commons.session_cache.stop()
+    if app.commons.table_versions is not None:
+        await app.commons.table_versions.stop()
     app.redis_cli.close()
     await app.redis_cli.wait_closed()
     app.db_pool.terminate()
+    for read_pool in app.db_read_pools:
+        read_pool.terminate()
+    app.commons.password_hasher.shutdown()
+    app.commons.export_executor.shutdown(wait=False)
+    await app.commons.access_log.stop()
 
 
-async def on_connect_postgres(conn):
+async def on_connect_postgres(conn, statement_timeout=None):
     async with conn.cursor() as cur:
         await cur.execute("SET session TIME ZONE %s", [local_tz.zone])
+        if statement_timeout is not None:
+            await cur.execute("SET statement_timeout = %s", [statement_timeout])
+
+
+async def create_db_pool(app, dsn):
+    config = app.config
+    pool = await aiopg.create_pool(
+        dsn,
+        minsize=config.db_pool_minsize,
+        maxsize=config.db_pool_maxsize,
+        timeout=config.db_timeout,
+        echo=False,
+        pool_recycle=config.db_pool_recycle,
+        on_connect=partial(on_connect_postgres, statement_timeout=config.db_statement_timeout))
+    return InstrumentedPool(pool, acquire_timeout=config.db_acquire_timeout)
 
 
 async def init_resources(app):
     dsn = f'dbname={POSTGRES_DB} user={POSTGRES_USER} password={POSTGRES_PASSWORD} host={POSTGRES_HOST} port={POSTGRES_PORT}' # noqa
-    pool = await aiopg.create_pool(dsn, echo=False, pool_recycle=3600, on_connect=on_connect_postgres)
-    app.db_pool = pool
-    if REDIS_PASSWORD:
-        redis_pool = await aioredis.create_pool(
-            f"redis://{REDIS_HOST}:{REDIS_PORT}",
-            password=REDIS_PASSWORD,
-            db=REDIS_DB,
-            encoding="utf8")
+    app.db_pool = await create_db_pool(app, dsn)
+    app.db_read_pools = [await create_db_pool(app, replica_dsn) for replica_dsn in app.config.db_replica_dsns]
+    # used by synchronous connections (i.e. COPY-based exports), mirrors `on_connect_postgres`
+    sync_options = f'-c TimeZone={local_tz.zone}'
+    if app.config.db_statement_timeout is not None:
+        sync_options += f' -c statement_timeout={app.config.db_statement_timeout}'
+    app.db_export_dsns = [make_dsn(export_dsn, options=sync_options)
+                          for export_dsn in app.config.db_replica_dsns or [dsn]]
+    redis_opts = {'password': REDIS_PASSWORD} if REDIS_PASSWORD else {}
+    redis_pool = await aioredis.create_pool(
+        f"redis://{REDIS_HOST}:{REDIS_PORT}",
+        db=REDIS_DB,
+        encoding="utf8",
+        minsize=app.config.redis_pool_minsize,
+        maxsize=app.config.redis_pool_maxsize,
+        **redis_opts)
+    if app.commons.metrics is not None:
+        app.redis_cli = InstrumentedRedis(redis_pool, app.commons.metrics.redis_latency)
     else:
-        redis_pool = await aioredis.create_pool(
-            f"redis://{REDIS_HOST}:{REDIS_PORT}",
-            db=REDIS_DB,
-            encoding="utf8")
-    app.redis_cli = aioredis.Redis(redis_pool)
+        app.redis_cli = aioredis.Redis(redis_pool)
+    if app.commons.session_cache is not None:
+        app.commons.session_cache.start()
+    if app.commons.table_versions is not None:
+        app.commons.table_versions.start()
+    await app.commons.access_log.start()
     app.info_logger.debug("Resources set up OK")
 
 
@@ -142,8 +181,41 @@ class AppConfig:
     url_prefix: str = ''
     version: str = 'unreleased'
 
+    # db
+    db_pool_minsize: int = 1
+    db_pool_maxsize: int = 10
+    db_pool_recycle: int = 3600
+    db_timeout: float = 60.0
+    db_acquire_timeout: Optional[float] = None
+    db_statement_timeout: Optional[int] = None  # in milliseconds
+    db_replica_dsns: List[str] = field(default_factory=list)
+    export_concurrency: int = 4
+    redis_pool_minsize: int = 1
+    redis_pool_maxsize: int = 10
+    request_transactions: bool = False
+    prepared_statements: bool = False
+    prepared_statements_cache_size: int = 256
+    where_plan_cache_size: int = 1024
+    stream_batch_size: int = 1000
+    json_passthrough: bool = False
+    response_cache: bool = False
+    response_cache_size: int = 1000
+    response_cache_ttl: int = 60
+    response_cache_redis: bool = False
+    versioned_etags: bool = False
+    slow_query_threshold: Optional[float] = None  # in seconds
+    slow_query_explain_rate: float = 0.0
+    slow_query_top_size: int = 100
+
     # auth
     activate_invited_user_with_sms: bool = False
+    bcrypt_pool_size: int = 4
+    bcrypt_max_queue: int = 64
+    decrypt_cache_size: int = 10000
+    decrypt_negative_ttl: int = 10
+    session_cache: bool = False
+    session_cache_size: int = 10000
+    session_cache_ttl: int = 30
     fernet: Fernet = Fernet(os.environ.get('FERNET_KEY').encode())
     redirect_reset_password_to: str = ''
     roles: List[str] = field(default_factory=list)
@@ -160,6 +232,13 @@ class AppConfig:
     info_logger_processors: Optional[list] = None
     error_logger_processors: Optional[list] = None
     default_logging_level: Optional[int] = None
+    access_log_sink: str = 'stdout'  # or 'file:<path>', 'udp://<host>:<port>'
+    access_log_buffer_size: int = 10000
+    access_log_batch_size: int = 500
+    access_log_flush_interval: float = 1.0
+    request_timing: bool = False
+    server_timing: bool = False
+    metrics: bool = False
 
     # TTLs
     session_ttl: int = 3600 * 24 * 30  # a month
@@ -294,6 +373,17 @@ class PathReturner:
         return out
 
 
+async def metrics_exposition(request):
+    '''Expose the collected metrics in the Prometheus text format'''
+    commons = request.app.commons
+    lines = []
+    if commons.metrics is not None:
+        lines.extend(commons.metrics.render())
+    if request.app.config.request_timing:
+        lines.extend(commons.phase_timings.render())
+    return aiohttp.web.Response(text='\n'.join(lines) + '\n', content_type='text/plain')
+
+
 async def apispec_metainfo(request):
     '''Return current hashsum for the OpenAPI spec + authentication status'''
     is_authed = request.session.is_authed
@@ -317,6 +407,28 @@ async def apispec_metainfo(request):
     })
 
 
+async def slow_queries(request):
+    '''Slow query shapes, worst first. DELETE resets the table.'''
+    if request.method == 'DELETE':
+        request.app.commons.slow_queries.reset()
+        raise aiohttp.web.HTTPNoContent()
+    try:
+        limit = int(request.query['limit']) if 'limit' in request.query else None
+    except ValueError:
+        raise post_exceptions.ValidationError({'limit': ['Not a valid integer.']})
+    return json_response(request.app.commons.slow_queries.top(limit))
+
+
+def add_monitoring_routes(router, url_prefix, app_config):
+    '''Register the metrics and slow query endpoints, if their features are enabled'''
+    if app_config.request_timing or app_config.metrics:
+        router.add_get(f'{url_prefix}/metrics/', metrics_exposition)
+    if app_config.slow_query_threshold is not None:
+        slow_queries_view = auth(roles=['Admin'])(slow_queries)
+        router.add_get(f'{url_prefix}/slow_queries/', slow_queries_view)
+        router.add_delete(f'{url_prefix}/slow_queries/', slow_queries_view)
+
+
 def setup_postschema(app, appname: str, *,
                      plugin_config={},
                      extra_config={},
@@ -351,7 +463,7 @@ def setup_postschema(app, appname: str, *,
     }
 
     # create loggers
-    info_logger, error_logger, access_logger = setup_logging(
+    info_logger, error_logger = setup_logging(
         app_config.info_logger_processors,
         app_config.error_logger_processors,
         app_config.default_logging_level)
@@ -366,11 +478,11 @@ def setup_postschema(app, appname: str, *,
     ScopeBase._validate_roles(ROLES)
 
     # setup middlewares
-    app.middlewares.append(middlewares.postschema_middleware)
+    app.middlewares.extend([middlewares.metrics_middleware, middlewares.db_middleware,
+                            middlewares.postschema_middleware])
 
     app.info_logger = info_logger.new(**app_config.initial_logging_context)
     app.error_logger = error_logger.new(**app_config.initial_logging_context)
-    app.access_logger = access_logger.new(**app_config.initial_logging_context)
 
     aiojobs_setup(app, exception_handler=exception_handler(app.error_logger))
 
@@ -478,3 +590,4 @@ def setup_postschema(app, appname: str, *,
     router.add_get(f'{url_prefix}/doc/openapi.yaml', apispec_context)
     router.add_get(f'{url_prefix}/doc/spec.json', actor_apispec)
     router.add_get(f'{url_prefix}/doc/meta/', apispec_metainfo)
+    add_monitoring_routes(router, url_prefix, app_config)
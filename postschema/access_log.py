@@ -0,0 +1,156 @@
+import asyncio
+import sys
+import time
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from urllib.parse import urlparse
+
+import orjson
+
+from .utils import orjson_default
+
+MAX_DATAGRAM_SIZE = 65000
+
+
+class StdoutSink:
+    def write(self, lines):
+        sys.stdout.buffer.write(b''.join(lines))
+        sys.stdout.flush()
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    def __init__(self, path):
+        self.file = open(path, 'ab')
+
+    def write(self, lines):
+        self.file.write(b''.join(lines))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class UDPSink:
+    '''One datagram per record, records past `MAX_DATAGRAM_SIZE` get truncated'''
+
+    def __init__(self, host, port):
+        self.address = (host, port)
+        self.transport = None
+
+    async def connect(self):
+        self.transport, _ = await asyncio.get_event_loop().create_datagram_endpoint(
+            asyncio.DatagramProtocol, remote_addr=self.address)
+
+    def write(self, lines):
+        for line in lines:
+            self.transport.sendto(line[:MAX_DATAGRAM_SIZE])
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+
+def make_sink(spec):
+    '''Make a sink off its spec: `stdout`, `file:<path>` or `udp://<host>:<port>`'''
+    if spec == 'stdout':
+        return StdoutSink()
+    if spec.startswith('file:'):
+        return FileSink(spec[5:])
+    if spec.startswith('udp://'):
+        url = urlparse(spec)
+        return UDPSink(url.hostname, url.port)
+    raise ValueError(f'Unrecognized access log sink: {spec}')
+
+
+class AccessLog:
+    '''Access log pipeline. Handlers push the records onto a bounded ring buffer,
+    drained by a background task writing them out to the sink as JSON lines, in batches.
+
+    Once the buffer's full, the oldest records are dropped and counted as such,
+    rather than letting the backlog grow or the handlers wait on the sink.
+    '''
+
+    def __init__(self, app, sink='stdout', maxsize=10000, batch_size=500, flush_interval=1.0):
+        self.app = app
+        self.sink = make_sink(sink)
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.records = deque(maxlen=maxsize)
+        self._wakeup = asyncio.Event()
+        self._drainer = None
+        self._stopping = False
+        # off the default executor, not to compete with the other blocking work for its threads
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='postschema_access_log')
+        # metrics
+        self.pushed = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+    def push(self, record):
+        if len(self.records) == self.maxsize:
+            self.dropped += 1
+        record['ts'] = time.time()
+        self.records.append(record)
+        self.pushed += 1
+        if len(self.records) >= self.batch_size:
+            self._wakeup.set()
+
+    def _take_batch(self):
+        records = self.records
+        return [orjson.dumps(records.popleft(), default=orjson_default) + b'\n'
+                for _ in range(min(self.batch_size, len(records)))]
+
+    async def _write(self, lines):
+        try:
+            if isinstance(self.sink, UDPSink):
+                # non-blocking already
+                self.sink.write(lines)
+            else:
+                await asyncio.get_event_loop().run_in_executor(self._executor, self.sink.write, lines)
+        except Exception:
+            self.failed += len(lines)
+            self.app.error_logger.exception('Failed to write access log records')
+        else:
+            self.written += len(lines)
+
+    async def flush(self):
+        while self.records:
+            await self._write(self._take_batch())
+
+    async def _drain(self):
+        while not self._stopping:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def start(self):
+        if isinstance(self.sink, UDPSink):
+            await self.sink.connect()
+        self._drainer = asyncio.ensure_future(self._drain())
+
+    async def stop(self):
+        '''Write out whatever's left in the buffer and close the sink'''
+        self._stopping = True
+        self._wakeup.set()
+        if self._drainer is not None:
+            await self._drainer
+        await self.flush()
+        self.sink.close()
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            'buffered': len(self.records),
+            'pushed': self.pushed,
+            'dropped': self.dropped,
+            'written': self.written,
+            'failed': self.failed
+        }
@@ -5,7 +5,6 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
 import aiosmtplib
-import bcrypt
 import pyotp
 import sqlalchemy as sql
 from aiojobs.aiohttp import spawn
@@ -264,7 +263,7 @@ async def login(request, payload, is_trusted=False):
 
     if not is_trusted:
         try:
-            if not bcrypt.checkpw(payload['password'].encode(), data['password'].encode()):
+            if not await request.app.commons.password_hasher.checkpw(payload['password'], data['password']):
                 raise web.HTTPForbidden(reason='Invalid login or password')
         except ValueError:
             # invalid salt
@@ -309,6 +308,7 @@ async def login(request, payload, is_trusted=False):
     if workspace_ids:
         pipe.sadd(workspaces_key, *workspace_ids)
     await pipe.execute()
+    await request.app.commons.invalidate_session(actor_id)
 
     session_token = request.app.commons.encrypt(actor_id)
     response = json_response({
@@ -367,6 +367,7 @@ class LogoutView(AuxView):
                 account_key = self.request.app.config.account_details_key.format(actor_id)
                 roles_key = self.request.app.config.roles_key.format(actor_id)
                 await self.request.app.redis_cli.delete(account_key, roles_key)
+                await self.request.app.commons.invalidate_session(actor_id)
             except (AttributeError, KeyError):
                 # session cookie doesn't point to any actor Ids nor session caches
                 actor_id = 'unrecognized'
@@ -418,6 +419,7 @@ class PhoneActivationView(AuxView):
             return resp
         account_key = self.request.app.config.account_details_key.format(actor_id)
         self.request.app.redis_cli.hset(account_key, 'phone_confirmed', 1)
+        await self.request.app.commons.invalidate_session(actor_id)
         await self.request.session.set_session_context()
         self.request.app.info_logger.info("Session context updated",
                                           actor_id=actor_id, changes={'phone_confirmed': 1})
@@ -461,6 +463,7 @@ class VerfiyEmailAddress(AuxView):
             return resp
         account_key = self.request.app.config.account_details_key.format(actor_id)
         self.request.app.redis_cli.hset(account_key, 'email_confirmed', 1)
+        await self.request.app.commons.invalidate_session(actor_id)
         await self.request.session.set_session_context()
         self.request.app.info_logger.info("Session context updated",
                                           actor_id=actor_id, changes={'email_confirmed': 1})
@@ -637,7 +640,7 @@ class ChangePassword(AuxView):
         actor_id = await self.request.app.redis_cli.get(key)
         await self.request.app.redis_cli.delete(key)
 
-        password = bcrypt.hashpw(payload['password1'].encode(), bcrypt.gensalt()).decode()
+        password = await self.request.app.commons.password_hasher.hashpw(payload['password1'])
         query = 'UPDATE actor SET password=%s WHERE id=%s RETURNING id'
 
         async with self.request.app.db_pool.acquire() as conn:
@@ -810,6 +813,7 @@ class GrantRole(AuxView):
         if await self.request.app.redis_cli.exists(roles_key):
             await self.request.app.redis_cli.delete(roles_key)
             await self.request.app.redis_cli.sadd(roles_key, *new_roles)
+        await self.request.app.commons.invalidate_session(actor_id)
 
         return web.HTTPOk()
 
@@ -884,6 +888,7 @@ class GrantRole(AuxView):
             await self.request.app.redis_cli.delete(roles_key)
             if new_roles:
                 await self.request.app.redis_cli.sadd(roles_key, *new_roles)
+        await self.request.app.commons.invalidate_session(actor_id)
 
         return web.HTTPOk()
 
@@ -914,6 +919,7 @@ class GrantRole(AuxView):
             await self.request.app.redis_cli.delete(roles_key)
             if new_roles:
                 await self.request.app.redis_cli.sadd(roles_key, *new_roles)
+        await self.request.app.commons.invalidate_session(actor_id)
 
         return web.HTTPOk()
 
@@ -993,6 +999,7 @@ class GrantWorkspace(AuxView):
         if await self.request.app.redis_cli.exists(workspaces_key):
             await self.request.app.redis_cli.delete(workspaces_key)
             await self.request.app.redis_cli.sadd(workspaces_key, *new_workspaces)
+        await self.request.app.commons.invalidate_session(actor_id)
 
         return web.HTTPOk()
 
@@ -1041,6 +1048,7 @@ class GrantWorkspace(AuxView):
         if await self.request.app.redis_cli.exists(workspaces_key):
             await self.request.app.redis_cli.delete(workspaces_key)
             await self.request.app.redis_cli.sadd(workspaces_key, *new_workspaces)
+        await self.request.app.commons.invalidate_session(actor_id)
 
         return web.HTTPOk()
 
@@ -1229,7 +1237,7 @@ class PrincipalActorBase(RootSchema):
         set_values = ','.join(f'{name}_confirmed=False' for name in names_changed)
         query = f'UPDATE actor SET {set_values} WHERE id=%s RETURNING 1'
 
-        async with request.app.db_pool.acquire() as conn:
+        async with request.db.acquire() as conn:
             async with conn.cursor() as cur:
                 try:
                     await cur.execute(query, [actor_id])
@@ -1256,6 +1264,7 @@ class PrincipalActorBase(RootSchema):
             pipe.hset(account_key, f'{name}_confirmed', '0')
             request.session._session_ctxt[f'{name}_confirmed'] = False
         await pipe.execute()
+        await request.app.commons.invalidate_session(actor_id)
         request.app.info_logger.info("Session context updated", actor_id=actor_id, changes=zipped_changes)
         return web.HTTPNoContent()
 
@@ -1314,8 +1323,7 @@ class PrincipalActorBase(RootSchema):
                         details, schema=scope_inst(), envelope_key='details')
                     data['details'] = Json(details_payload)
 
-        salt = bcrypt.gensalt()
-        data['password'] = bcrypt.hashpw(data['password'].encode(), salt).decode()
+        data['password'] = await request.app.commons.password_hasher.hashpw(data['password'])
         data['email_confirmed'] = True
 
         if request.app.config.activate_invited_user_with_sms:
@@ -1416,8 +1424,7 @@ class PrincipalActorBase(RootSchema):
                         'email': ['Email address not available.']
                     })
 
-        salt = bcrypt.gensalt()
-        data['password'] = bcrypt.hashpw(data['password'].encode(), salt).decode()
+        data['password'] = await request.app.commons.password_hasher.hashpw(data['password'])
         return request.app.created_email_confirmation_link, request.app.config.activation_link_ttl
 
     async def before_post(self, parent, request, data):
@@ -1,14 +1,19 @@
+import re
 from dataclasses import dataclass, field
-from typing import Iterable
+from typing import Iterable, Optional
+
+SESSION_REF_PAT = re.compile(r'{session\.(\w+)}')
+# the parameters get quoted by the driver, so should the reference be quoted, the quotes go
+QUOTED_SESSION_REF_PAT = re.compile(r"'{session\.(\w+)}'")
 
 
 @dataclass
 class SessionContext:
-    actor_id: int = field(metadata={'format': "{}"})
-    workspace: int = field(metadata={'format': "{}"})
-    phone: str = field(metadata={'format': "'{}'"})
-    email: str = field(metadata={'format': "'{}'"})
-    status: int = field(metadata={'format': "{}"})
+    actor_id: int
+    workspace: int
+    phone: str
+    email: str
+    status: int
     workspaces: list = field(default_factory=list)
 
 
@@ -20,7 +25,7 @@ class ClauseBus(list):
 
     @property
     def stmt(self):
-        return ' '.join(getattr(i, 'clause', i) for i in self[::])
+        return ' '.join(getattr(i, 'stmt', i) for i in self[::])
 
     def __and__(self, other):
         if other in self:
@@ -45,6 +50,10 @@ class ClauseBus(list):
     def __repr__(self):
         return f'<ClauseBus({self.stmt})>'
 
+    @property
+    def session_fields(self):
+        return frozenset().union(*(clause_inst.session_fields for clause_inst in self[::2]))
+
     def digest(self, *args):
         for clause in self[::2]:
             clause.digest(*args)
@@ -54,6 +63,14 @@ class ClauseBus(list):
 @dataclass
 class PermClauseBase:
     clause: str
+    # session context fields the digested clause expects as `%(auth_<fieldname>)s` parameters
+    session_fields: frozenset = field(default=frozenset(), init=False)
+    # the digested clause, `clause` is left as defined so that it can be digested again
+    compiled: Optional[str] = field(default=None, init=False)
+
+    @property
+    def stmt(self):
+        return self.clause if self.compiled is None else self.compiled
 
     def __and__(self, other):
         return ClauseBus([self]) & other
@@ -126,19 +143,16 @@ class CheckedPermClause(PermClauseBase):
             if not issubclass(auth_field_type, Iterable):
                 raise TypeError(
                     f'Auth field `{op_path}->{orig_tablename}.{authfield_name}` is not of iterable type')
-            af = f'{{session.{authfield_name}}}'
-            precursor = f'''"{tablename}".{column}::text::jsonb <@ '{af}'::jsonb'''
+            precursor = f'''"{tablename}".{column}::text::jsonb <@ %(auth_{authfield_name})s::jsonb'''
 
         elif operator == '=':
             if issubclass(auth_field_type, Iterable):
                 raise TypeError(f'Auth field `{authfield_name}` is not supposed to be of iterable type')
 
-            authfield_format = SessionContext.__dataclass_fields__[authfield_name].metadata['format']
-            af = f'{{session.{authfield_name}}}'
-            formatted_authfield = authfield_format.format(af)
-            precursor = f'''"{tablename}".{column}={formatted_authfield}'''
+            precursor = f'''"{tablename}".{column}=%(auth_{authfield_name})s'''
 
-        self.clause = precursor
+        self.compiled = precursor
+        self.session_fields = frozenset([authfield_name])
         return precursor
 
 
@@ -148,4 +162,8 @@ class OpenPermClause(PermClauseBase):
     repr_name = 'OpenClause'
 
     def digest(self, *args):
-        return self.clause
+        # turn `{session.<fieldname>}` references into query parameters
+        self.session_fields = frozenset(SESSION_REF_PAT.findall(self.clause))
+        compiled = QUOTED_SESSION_REF_PAT.sub(r'%(auth_\1)s', self.clause)
+        self.compiled = SESSION_REF_PAT.sub(r'%(auth_\1)s', compiled)
+        return self.compiled
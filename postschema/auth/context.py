@@ -92,10 +92,22 @@ class AuthContext(AccessBase, StandaloneAuthedView):
             raise web.HTTPForbidden(reason=ILLEGAL_XROLE)
 
         auth_condition = self.level_permissions[selected_role].copy()
-        auth_condition['stmt'] = auth_condition['stmt'].format(session=self)
+        auth_condition['values'] = {
+            f'auth_{fieldname}': self._auth_param(fieldname)
+            for fieldname in auth_condition['session_fields']
+        }
 
         return auth_condition
 
+    def _auth_param(self, fieldname):
+        '''Session context value as a permission clause parameter.
+        Iterables are passed in their JSON array form, to be cast to `jsonb` by the clause.
+        '''
+        value = self.session_ctxt[fieldname]
+        if isinstance(value, BracketedFrozenset):
+            return repr(value)
+        return value
+
     def authorize(self):
         if not self.needs_session:
             return {}
@@ -162,15 +174,27 @@ class AuthContext(AccessBase, StandaloneAuthedView):
             if not self.needs_session and self.forced_logout:
                 # erase the session aka forced logout if this is an authed request
                 await self.request.app.redis_cli.delete(account_details_key, roles_key)
+                await self.request.app.commons.invalidate_session(actor_id)
                 self.session_ctxt = MappingProxyType({})
                 self.delete_session_cookie = True
                 return
 
-            pipe = self.request.app.redis_cli.pipeline()
-            pipe.hgetall(account_details_key)
-            pipe.smembers(workspaces_key)
-            pipe.smembers(roles_key)
-            session_ctxt, workspaces, roles = await pipe.execute()
+            session_cache = self.request.app.commons.session_cache
+            cached = session_cache.get(actor_id) if session_cache is not None else None
+            if cached is None:
+                generation = session_cache.generation if session_cache is not None else None
+                pipe = self.request.app.redis_cli.pipeline()
+                pipe.hgetall(account_details_key)
+                pipe.smembers(workspaces_key)
+                pipe.smembers(roles_key)
+                session_ctxt, workspaces, roles = await pipe.execute()
+                if session_ctxt and session_cache is not None:
+                    session_cache.set(actor_id, (dict(session_ctxt), workspaces, roles), generation)
+            else:
+                account_details, workspaces, roles = cached
+                # the session context gets modified further on, don't let it leak to the cache
+                session_ctxt = dict(account_details)
+
             if not session_ctxt:
                 # session cookie is valid, but not pointing to any active account
                 resp = web.HTTPUnauthorized(reason='Unknown actor')
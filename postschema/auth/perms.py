@@ -12,6 +12,7 @@ class PublicPrivatePerms:
     read: dict
     get: dict
     list: dict
+    export: dict
     update: dict
     put: dict
     patch: dict
@@ -23,6 +24,7 @@ class AuthedPermissions:
     read: Iterable
     get: Iterable
     list: Iterable
+    export: Iterable
     update: Iterable
     put: Iterable
     patch: Iterable
@@ -30,9 +32,11 @@ class AuthedPermissions:
 
 
 COMPOSITE_OPS = {
+    'post': ['post', 'post_many'],
     'read': ['get', 'list'],
     'update': ['patch', 'put']
 }
+ALL_OPERATIONS = [oper for op in ALL_BASIC_OPERATIONS for oper in COMPOSITE_OPS.get(op, [op])]
 
 
 @dataclass
@@ -107,7 +111,7 @@ class SchemaFactoryBase:
             invalid_roles = roles - self.roles
             if invalid_roles:
                 raise NameError(f'`{op_path}` contains invalid role(s) ({invalid_roles})')
-            return {}.fromkeys(ALL_BASIC_OPERATIONS, roles)
+            return {}.fromkeys(ALL_OPERATIONS, roles)
 
         perms = dd(dict)
         perm_template = PublicPrivatePerms if perm_cls_name == 'Private' else AuthedPermissions
@@ -135,7 +139,7 @@ class SchemaFactoryBase:
             public_perms.__dict__)
 
         if hasattr(public_perms, 'allow_all') and public_perms.allow_all:
-            return {}.fromkeys(ALL_BASIC_OPERATIONS, '*')
+            return {}.fromkeys(ALL_OPERATIONS, '*')
 
         for op_path, operation, details_struct in self.compile_perm_type(PublicPrivatePerms, 'Public'):
             operations = COMPOSITE_OPS.get(operation, [operation])
@@ -150,7 +154,8 @@ class SchemaFactoryBase:
             uo = ', '.join(unrecognized_ops)
             raise ValueError(
                 f"{self.schema_cls.__name__}.{perm_cls.__name__}.{routinename} contains undefined operations: ({uo})") # noqa
-        self.operation_constraints[routinename] = declared_ops
+        self.operation_constraints[routinename] = [
+            oper for op in declared_ops for oper in COMPOSITE_OPS.get(op, [op])]
 
 
 class TopSchemaPermFactory(SchemaFactoryBase):
@@ -175,6 +180,7 @@ class TopSchemaPermFactory(SchemaFactoryBase):
                 perms[oper][role] = {
                     'type': type(role),
                     'stmt': stmt,
+                    'session_fields': clause.session_fields,
                     'has_open_clauses': clause.has_open_clauses
                 }
         return perms
@@ -0,0 +1,161 @@
+import asyncio
+import time
+
+from collections import OrderedDict, defaultdict as dd
+from contextlib import suppress
+from hashlib import md5
+
+import orjson
+
+VERSIONS_KEY = 'postschema:table_versions'
+VERSIONS_CHANNEL = 'postschema:table_versions'
+RESPONSE_KEY = 'postschema:response:{}'
+
+
+def query_digest(query, values):
+    return md5(orjson.dumps([query, values], default=str)).hexdigest()
+
+
+def etag_matches(request, etag):
+    '''Check `etag` against the request's `If-None-Match` header'''
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        # weak comparison, as per RFC 7232
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+class TableVersions:
+    '''Per-table write counters. Kept in Redis, so that all the processes agree on them,
+    and mirrored in-process - updated over pub/sub - so that reading them costs nothing.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self.versions = dd(int)
+        # versions are only trusted while the updates are being received
+        self.listening = False
+        self._listener = None
+
+    def get(self, tables):
+        return tuple(self.versions[table] for table in tables)
+
+    def stamp(self, tables, digest):
+        '''Key `digest` with the current versions of `tables`, or None if these can't be trusted'''
+        if not self.listening:
+            return None
+        version = '.'.join(map(str, self.get(tables)))
+        return f'{digest}:{version}'
+
+    async def bump(self, tables):
+        pipe = self.app.redis_cli.pipeline()
+        for table in tables:
+            pipe.hincrby(VERSIONS_KEY, table, 1)
+        new_versions = dict(zip(tables, await pipe.execute()))
+        self._update(new_versions)
+        await self.app.redis_cli.publish(VERSIONS_CHANNEL, orjson.dumps(new_versions).decode())
+
+    def _update(self, new_versions):
+        for table, version in new_versions.items():
+            self.versions[table] = max(self.versions[table], int(version))
+
+    async def _listen(self):
+        while True:
+            try:
+                channel, = await self.app.redis_cli.subscribe(VERSIONS_CHANNEL)
+                # catch up on the bumps made while unsubscribed
+                self._update(await self.app.redis_cli.hgetall(VERSIONS_KEY))
+                self.listening = True
+                while await channel.wait_message():
+                    self._update(orjson.loads(await channel.get()))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.app.error_logger.exception('Table versions listener failed')
+            self.listening = False
+            await asyncio.sleep(1)
+
+    def start(self):
+        self._listener = asyncio.ensure_future(self._listen())
+
+    async def stop(self):
+        self.listening = False
+        if self._listener is not None:
+            self._listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._listener
+            with suppress(Exception):
+                await self.app.redis_cli.unsubscribe(VERSIONS_CHANNEL)
+
+
+class ResponseCache:
+    '''Cache of the `get`/`list` response bodies, held in a local LRU and optionally in Redis.
+
+    Keys are stamped by `TableVersions` with the versions of all the tables
+    the response was read from, so that a write to any of them makes the entries unreachable.
+    '''
+
+    def __init__(self, app, maxsize=1000, use_redis=False):
+        self.app = app
+        self.maxsize = maxsize
+        self.use_redis = use_redis
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        if key is None:
+            return None
+        try:
+            expires_at, body = self._entries[key]
+        except KeyError:
+            body = None
+        else:
+            if expires_at < time.monotonic():
+                self._entries.pop(key, None)
+                body = None
+            else:
+                self._entries.move_to_end(key)
+
+        if body is None and self.use_redis:
+            pipe = self.app.redis_cli.pipeline()
+            pipe.get(RESPONSE_KEY.format(key))
+            pipe.ttl(RESPONSE_KEY.format(key))
+            body, ttl = await pipe.execute()
+            # -2 if the entry expired in the meantime, -1 if it has no expiry to follow locally
+            if body is not None and ttl > 0:
+                self._store(key, body, ttl)
+
+        if body is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return body
+
+    def _store(self, key, body, ttl):
+        self._entries[key] = (time.monotonic() + ttl, body)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    async def set(self, key, body, ttl):
+        if key is None:
+            return
+        self._store(key, body, ttl)
+        if self.use_redis:
+            await self.app.redis_cli.set(RESPONSE_KEY.format(key), body, expire=ttl)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries)
+        }
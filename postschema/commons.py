@@ -1,11 +1,32 @@
+import base64
+import struct
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from aiohttp import web
+from cryptography.fernet import InvalidToken
 from marshmallow import fields
 from psycopg2 import errors as postgres_errors
 
 from . import exceptions as post_exceptions
 from .exceptions import WrongType
+from .access_log import AccessLog
+from .cache import ResponseCache, TableVersions
+from .hashing import PasswordHasher
+from .logging import access_msg_context
+from .session_cache import SessionCache
+from .slow_queries import SlowQueryLog
+from .metrics import Metrics, PhaseTimings
+from .statements import PlanCache, StatementCache
+from .timing import timed
 from .utils import parse_postgres_err, parse_postgres_constraint_err
 
+# same as Fernet's
+MAX_CLOCK_SKEW = 60
+
 
 @dataclass(frozen=True)
 class MANDATORY_PAGINATION_FIELDS:
@@ -26,9 +47,105 @@ class MANDATORY_PAGINATION_FIELDS:
                 raise WrongType(f"Pagination class {self._cls_name}'s `{k}` is not of {expected_type} type")
 
 
+class DecryptCache:
+    '''Bounded cache of verified Fernet tokens, mapping each token to its payload and issue time.
+
+    Once a token has been verified, its TTL can be checked arithmetically
+    against the issue time, with no need to re-run HMAC and AES on every request.
+    Tokens failing the verification get remembered for `negative_ttl` seconds.
+    '''
+
+    def __init__(self, fernet, maxsize=10000, negative_ttl=10):
+        self.fernet = fernet
+        self.maxsize = maxsize
+        self.negative_ttl = negative_ttl
+        self._verified = OrderedDict()
+        self._invalid = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _store(self, cache, token, value):
+        cache[token] = value
+        if len(cache) > self.maxsize:
+            cache.popitem(last=False)
+
+    def _verify(self, token):
+        try:
+            invalid_until = self._invalid[token]
+        except KeyError:
+            pass
+        else:
+            if invalid_until > time.monotonic():
+                raise InvalidToken
+            del self._invalid[token]
+
+        try:
+            payload = self.fernet.decrypt(token)
+        except InvalidToken:
+            self._store(self._invalid, token, time.monotonic() + self.negative_ttl)
+            raise
+        # version byte, followed by the big-endian 64-bit issue timestamp
+        issued_at, = struct.unpack('>Q', base64.urlsafe_b64decode(token)[1:9])
+        # decrypting with no TTL skips Fernet's check against tokens issued in the future
+        if issued_at > time.time() + MAX_CLOCK_SKEW:
+            self._store(self._invalid, token, time.monotonic() + self.negative_ttl)
+            raise InvalidToken
+        entry = (payload, issued_at)
+        self._store(self._verified, token, entry)
+        return entry
+
+    def decrypt(self, token, ttl=None):
+        try:
+            entry = self._verified[token]
+            self._verified.move_to_end(token)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            entry = self._verify(token)
+
+        payload, issued_at = entry
+        if ttl is not None and issued_at + ttl < int(time.time()):
+            raise InvalidToken
+        return payload
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._verified)
+        }
+
+
 class Commons:
     def __init__(self, app):
         self.app = app
+        self._read_pool_idx = -1
+        self._export_dsn_idx = -1
+        # COPY-based exports run on synchronous connections, off the default executor
+        self.export_executor = ThreadPoolExecutor(app.config.export_concurrency,
+                                                  thread_name_prefix='postschema_export')
+        self.active_exports = 0
+        self.statement_cache = StatementCache(app.config.prepared_statements_cache_size) \
+            if app.config.prepared_statements else None
+        self.where_plans = PlanCache(app.config.where_plan_cache_size)
+        self.phase_timings = PhaseTimings()
+        self.metrics = Metrics(app) if app.config.metrics else None
+        self.access_log = AccessLog(app, app.config.access_log_sink, app.config.access_log_buffer_size,
+                                    app.config.access_log_batch_size, app.config.access_log_flush_interval)
+        self.decrypt_cache = DecryptCache(app.config.fernet, app.config.decrypt_cache_size,
+                                          app.config.decrypt_negative_ttl) \
+            if app.config.decrypt_cache_size else None
+        self.password_hasher = PasswordHasher(app.config.bcrypt_pool_size, app.config.bcrypt_max_queue)
+        self.session_cache = SessionCache(app, app.config.session_cache_size, app.config.session_cache_ttl) \
+            if app.config.session_cache else None
+        self.table_versions = TableVersions(app) \
+            if app.config.response_cache or app.config.versioned_etags else None
+        self.response_cache = ResponseCache(app, app.config.response_cache_size,
+                                            app.config.response_cache_redis) \
+            if app.config.response_cache else None
+        self.slow_queries = SlowQueryLog(app, app.config.slow_query_threshold, app.config.slow_query_top_size,
+                                         app.config.slow_query_explain_rate) \
+            if app.config.slow_query_threshold is not None else None
 
     def encrypt(self, string):
         encoded_payload = str(string).encode()
@@ -36,12 +153,58 @@ class Commons:
 
     def decrypt(self, encrypted, **opts):
         encoded_payload = encrypted.encode()
+        if self.decrypt_cache is not None:
+            return self.decrypt_cache.decrypt(encoded_payload, **opts).decode()
         return self.app.config.fernet.decrypt(encoded_payload, **opts).decode()
 
-    async def execute(self, cur, query, params=[], envelope=None):
+    def read_pool(self):
+        '''Pick the pool to read from, rotating through the read replicas if there are any'''
+        read_pools = self.app.db_read_pools
+        if not read_pools:
+            return self.app.db_pool
+        self._read_pool_idx = (self._read_pool_idx + 1) % len(read_pools)
+        return read_pools[self._read_pool_idx]
+
+    def export_dsn(self):
+        '''Pick the DSN to export from, rotating through the read replicas if there are any'''
+        export_dsns = self.app.db_export_dsns
+        self._export_dsn_idx = (self._export_dsn_idx + 1) % len(export_dsns)
+        return export_dsns[self._export_dsn_idx]
+
+    @contextmanager
+    def export_slot(self):
+        '''Hold one of the `export_concurrency` slots, answering with 503 when they're all taken.
+        Every export holds a Postgres connection and a thread until it's done, hence the bound.
+        '''
+        if self.active_exports >= self.app.config.export_concurrency:
+            raise web.HTTPServiceUnavailable(reason='Too many exports in progress, try again later')
+        self.active_exports += 1
+        try:
+            yield
+        finally:
+            self.active_exports -= 1
+
+    async def invalidate_session(self, *actor_ids):
+        '''Drop the cached session contexts of `actor_ids`, across all the processes'''
+        if self.session_cache is not None:
+            await self.session_cache.invalidate(*actor_ids)
+
+    async def run_query(self, cur, query, params=None, prepare=False):
+        '''Execute `query`, through a server-side prepared statement if requested and enabled'''
+        with timed('query'):
+            started_at = time.perf_counter()
+            if prepare and self.statement_cache is not None:
+                result = await self.statement_cache.execute(cur, query, params)
+            else:
+                result = await cur.execute(query, params)
+        if self.slow_queries is not None:
+            await self.slow_queries.observe(query, params, time.perf_counter() - started_at)
+        return result
+
+    async def execute(self, cur, query, params=[], envelope=None, prepare=False):
 
         try:
-            await cur.execute(query, params)
+            await self.run_query(cur, query, params, prepare=prepare)
         except postgres_errors.IntegrityError as ierr:
             parsed_err = None
             constraint_key = parse_postgres_constraint_err(ierr)
@@ -52,12 +215,10 @@ class Commons:
                 envelope: parsed_err
             } if envelope else parsed_err
 
-            self.app.access_logger = self.app.access_logger.bind(
-                msg_context=dict(
-                    errors=errors,
-                    query=cur.query.decode()
-                )
-            )
+            access_msg_context.set(dict(
+                errors=errors,
+                query=cur.query.decode()
+            ))
             raise post_exceptions.ValidationError(errors)
 
         except postgres_errors.DataException as derr:
@@ -71,12 +232,10 @@ class Commons:
                     envelope: base
                 } if envelope else base
 
-            self.app.access_logger = self.app.access_logger.bind(
-                msg_context=dict(
-                    errors=errors,
-                    query=cur.query.decode()
-                )
-            )
+            access_msg_context.set(dict(
+                errors=errors,
+                query=cur.query.decode()
+            ))
             raise post_exceptions.ValidationError(errors)
 
         except Exception:
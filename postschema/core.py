@@ -25,7 +25,7 @@ from . import (
     fields as postschema_fields,
     validators as postschema_validators
 )
-from .auth.perms import TopSchemaPermFactory, AuxSchemaPermFactory
+from .auth.perms import COMPOSITE_OPS, TopSchemaPermFactory, AuxSchemaPermFactory
 from .schema import DefaultMetaBase
 from .spec import APISpecBuilder
 from .utils import retype_schema
@@ -180,7 +180,8 @@ class ViewMaker:
 
     @property
     def excluded_ops(self):
-        return self.meta_cls.excluded_ops
+        # excluding `post` excludes `post_many` too
+        return [oper for op in self.meta_cls.excluded_ops for oper in COMPOSITE_OPS.get(op, [op])]
 
     @property
     @lru_cache()
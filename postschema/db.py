@@ -0,0 +1,226 @@
+import asyncio
+import time
+
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from aiohttp import web
+from aiojobs.aiohttp import spawn
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from .timing import timed
+
+TRANSACTIONAL_OPS = frozenset(['post', 'post_many', 'put', 'patch', 'delete'])
+READ_OPS = frozenset(['get', 'list'])
+
+# cleared for the jobs spawned off a request, see `spawn_detached`
+in_request_flow = ContextVar('in_request_flow', default=True)
+
+
+async def _detached(coro):
+    in_request_flow.set(False)
+    return await coro
+
+
+async def spawn_detached(request, coro):
+    '''Spawn `coro` as a background job running on pooled connections,
+    so that the request's connection never has to wait for it
+    '''
+    return await spawn(request, _detached(coro))
+
+
+class _PoolAcquireContext:
+    def __init__(self, pool):
+        self.pool = pool
+        self.conn = None
+
+    def __await__(self):
+        return self.pool._acquire().__await__()
+
+    async def __aenter__(self):
+        self.conn = await self.pool._acquire()
+        return self.conn
+
+    async def __aexit__(self, *exc):
+        conn, self.conn = self.conn, None
+        await self.pool.release(conn)
+
+
+class InstrumentedPool:
+    '''Wraps an aiopg pool, bounding the acquisition time and keeping track of its gauges.
+    Requests timing out while waiting for a connection get a 503.
+    '''
+
+    def __init__(self, pool, acquire_timeout=None):
+        self.pool = pool
+        self.acquire_timeout = acquire_timeout
+        self.waiting = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.acquire_latency_total = 0.0
+        self.acquire_latency_max = 0.0
+
+    def __getattr__(self, name):
+        return getattr(self.pool, name)
+
+    def acquire(self):
+        return _PoolAcquireContext(self)
+
+    async def _acquire(self):
+        self.waiting += 1
+        started_at = time.monotonic()
+        try:
+            with timed('acquire'):
+                conn = await asyncio.wait_for(self.pool.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise web.HTTPServiceUnavailable(reason='Database busy, try again later')
+        finally:
+            self.waiting -= 1
+        latency = time.monotonic() - started_at
+        self.acquired += 1
+        self.acquire_latency_total += latency
+        self.acquire_latency_max = max(self.acquire_latency_max, latency)
+        return conn
+
+    def stats(self):
+        return {
+            'size': self.pool.size,
+            'free': self.pool.freesize,
+            'in_use': self.pool.size - self.pool.freesize,
+            'maxsize': self.pool.maxsize,
+            'waiting': self.waiting,
+            'acquired': self.acquired,
+            'timeouts': self.timeouts,
+            'acquire_latency_total': self.acquire_latency_total,
+            'acquire_latency_max': self.acquire_latency_max
+        }
+
+
+class RequestDB:
+    '''Request-scoped connection, acquired off the pool on first use and released
+    by `db_middleware` once the response is ready.
+
+    With `request_transactions` enabled, write operations run in a single
+    transaction, committed at the end of the request unless it failed.
+    Reads made by `get` and `list` requests go to a read replica, if any is configured.
+    Jobs spawned with `spawn_detached`, code running once the response is ready
+    or concurrently with the connection's current user get a pooled connection instead.
+
+    Jobs registered with `after_commit` (e.g. the after_* hooks) get spawned once the request's
+    writes are committed, and dropped if they're rolled back. `after_close` ones get spawned either way.
+    '''
+
+    def __init__(self, request):
+        self.request = request
+        self.pool = request.app.db_pool
+        # connections by pool
+        self._conns = {}
+        self._owner = None
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._closed = False
+        # tables modified by the request, see `TableVersions`
+        self.written_tables = set()
+        # (coroutine, spawned on rollback as well)
+        self._jobs = []
+
+    @property
+    def transactional(self):
+        return (self.request.app.config.request_transactions
+                and getattr(self.request, 'operation', None) in TRANSACTIONAL_OPS)
+
+    def _pick_pool(self, read):
+        if read and getattr(self.request, 'operation', None) in READ_OPS:
+            return self.request.app.commons.read_pool()
+        return self.pool
+
+    async def _connect(self, pool):
+        try:
+            return self._conns[pool]
+        except KeyError:
+            pass
+        conn = await pool.acquire()
+        self._conns[pool] = conn
+        if pool is self.pool and self.transactional:
+            async with conn.cursor() as cur:
+                await cur.execute('BEGIN')
+        return conn
+
+    @asynccontextmanager
+    async def acquire(self, read=False):
+        '''Acquire the request's connection. `read` allows for it to come off a read replica.'''
+        pool = self._pick_pool(read)
+        task = asyncio.current_task()
+        if self._closed or not in_request_flow.get() or self._owner not in (None, task):
+            async with pool.acquire() as conn:
+                yield conn
+            return
+
+        outermost = self._owner is None
+        self._owner = task
+        self._idle.clear()
+        try:
+            yield await self._connect(pool)
+        finally:
+            if outermost:
+                self._owner = None
+                self._idle.set()
+
+    def after_commit(self, coro):
+        '''Spawn `coro` as a detached job once the request's writes are committed'''
+        self._jobs.append((coro, False))
+
+    def after_close(self, coro):
+        '''Spawn `coro` as a detached job once the request's connection is released'''
+        self._jobs.append((coro, True))
+
+    async def _spawn_jobs(self, jobs, committed):
+        for coro, always in jobs:
+            if committed or always:
+                await spawn_detached(self.request, coro)
+            else:
+                coro.close()
+
+    @asynccontextmanager
+    async def transaction(self, cur):
+        '''Run a block atomically, as a savepoint if a transaction is already in progress'''
+        if cur.connection.raw.get_transaction_status() == TRANSACTION_STATUS_IDLE:
+            async with cur.begin():
+                yield
+            return
+
+        await cur.execute('SAVEPOINT postschema_block')
+        try:
+            yield
+        except BaseException:
+            await cur.execute('ROLLBACK TO SAVEPOINT postschema_block')
+            raise
+        await cur.execute('RELEASE SAVEPOINT postschema_block')
+
+    async def close(self, commit=True):
+        self._closed = True
+        # let a task of the request's own still using the connection finish first,
+        # spawned jobs never hold it (see `spawn_detached`)
+        await self._idle.wait()
+        conns, self._conns = self._conns, {}
+        jobs, self._jobs = self._jobs, []
+        try:
+            for pool, conn in conns.items():
+                try:
+                    if conn.raw.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                        async with conn.cursor() as cur:
+                            await cur.execute('COMMIT' if commit else 'ROLLBACK')
+                finally:
+                    await pool.release(conn)
+        except BaseException:
+            await self._spawn_jobs(jobs, committed=False)
+            raise
+        if commit and self.written_tables:
+            # the writes are in by now, a failure to announce them mustn't fail the request
+            try:
+                await self.request.app.commons.table_versions.bump(sorted(self.written_tables))
+            except Exception:
+                self.request.app.error_logger.exception('Failed to bump the table versions',
+                                                        tables=sorted(self.written_tables))
+        await self._spawn_jobs(jobs, committed=commit)
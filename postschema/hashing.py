@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from aiohttp import web
+
+
+class PasswordHasher:
+    '''Runs the bcrypt work in a bounded thread pool, off the event loop.
+
+    bcrypt releases the GIL, so the threads hash in parallel. Once more than
+    `max_queue` calls are waiting for a free thread, new ones get rejected with 503.
+    '''
+
+    def __init__(self, pool_size=4, max_queue=64):
+        self.pool_size = pool_size
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='postschema-bcrypt')
+        self.pending = 0
+        # metrics
+        self.calls = 0
+        self.rejected = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.hash_time_total = 0.0
+
+    @property
+    def queue_depth(self):
+        return max(self.pending - self.pool_size, 0)
+
+    @staticmethod
+    def _call_soon(loop, callback, *args):
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # the loop is closed, i.e. the app is shutting down
+            pass
+
+    def _timed(self, loop, fn, submitted_at, *args):
+        started_at = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            # the counters are only ever updated on the loop
+            self._call_soon(loop, self._record, started_at - submitted_at, time.monotonic() - started_at)
+
+    def _record(self, queue_wait, hash_time):
+        self.queue_wait_total += queue_wait
+        self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+        self.hash_time_total += hash_time
+
+    def _release(self):
+        self.pending -= 1
+
+    async def _run(self, fn, *args):
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise web.HTTPServiceUnavailable(reason='Server busy, try again later')
+
+        loop = asyncio.get_event_loop()
+        self.pending += 1
+        self.calls += 1
+        future = self.executor.submit(self._timed, loop, fn, time.monotonic(), *args)
+        # released once the thread is done, as it keeps hashing even if the awaiting request gets cancelled
+        future.add_done_callback(lambda _: self._call_soon(loop, self._release))
+        return await asyncio.wrap_future(future, loop=loop)
+
+    async def hashpw(self, password):
+        hashed = await self._run(bcrypt.hashpw, password.encode(), bcrypt.gensalt())
+        return hashed.decode()
+
+    async def checkpw(self, password, hashed):
+        return await self._run(bcrypt.checkpw, password.encode(), hashed.encode())
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'rejected': self.rejected,
+            'pending': self.pending,
+            'queue_depth': self.queue_depth,
+            'queue_wait_total': self.queue_wait_total,
+            'queue_wait_max': self.queue_wait_max,
+            'hash_time_total': self.hash_time_total
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
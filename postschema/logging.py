@@ -1,9 +1,23 @@
 import logging
 import os
+from contextvars import ContextVar
 from functools import lru_cache
 
 import structlog
 
+# request-scoped logging context, set by `postschema_middleware`
+request_log_context = ContextVar('request_log_context', default=None)
+# extra details of the request's outcome (e.g. failed query's errors), picked up by the access log
+access_msg_context = ContextVar('access_msg_context', default=None)
+
+
+def merge_request_context(logger, method_name, event_dict):
+    context = request_log_context.get()
+    if context:
+        for key, val in context.items():
+            event_dict.setdefault(key, val)
+    return event_dict
+
 
 DEFAULT_INFO_LOGGER_PROCESSORS = [
     structlog.stdlib.filter_by_level,
@@ -38,16 +52,8 @@ _cached_loggers = []
 
 
 class BoundLogger(structlog.stdlib.BoundLogger):
-
-    _orig_context = {}
-
-    def __init__(self, logger, processors, context):
-        super().__init__(logger, processors, context)
-        if not BoundLogger._orig_context:
-            BoundLogger._orig_context = context.copy()
-
-    def renew(self, **keys):
-        return self.new(**keys, **self._orig_context)
+    '''App-wide loggers are never rebound per request,
+    the request's context gets merged in by `merge_request_context` instead.'''
 
 
 def setup_logging(info_logger_processors: list = [],
@@ -63,8 +69,8 @@ def setup_logging(info_logger_processors: list = [],
     if default_logging_level is None:
         default_logging_level = logging.DEBUG if istest else logging.INFO
 
-    info_processors = info_logger_processors or DEFAULT_INFO_LOGGER_PROCESSORS[:]
-    error_processors = error_logger_processors or DEFAULT_ERROR_LOGGER_PROCESSORS[:]
+    info_processors = [merge_request_context, *(info_logger_processors or DEFAULT_INFO_LOGGER_PROCESSORS)]
+    error_processors = [merge_request_context, *(error_logger_processors or DEFAULT_ERROR_LOGGER_PROCESSORS)]
     info_logger_wrapper_class = BoundLogger
     error_logger_wrapper_class = BoundLogger
 
@@ -82,7 +88,6 @@ def setup_logging(info_logger_processors: list = [],
     )
 
     infologger = LevelLogger('postschema.log', default_logging_level)
-    accesslogger = LevelLogger('postschema.access', default_logging_level)
     errorlogger = LevelLogger('postschema.error', logging.ERROR)
 
     info_logger = structlog.wrap_logger(
@@ -96,13 +101,7 @@ def setup_logging(info_logger_processors: list = [],
         wrapper_class=error_logger_wrapper_class
     )
 
-    access_logger = structlog.wrap_logger(
-        accesslogger,
-        processors=info_processors,
-        wrapper_class=info_logger_wrapper_class
-    )
-
     if not _cached_loggers:
-        _cached_loggers.extend([info_logger, error_logger, access_logger])
+        _cached_loggers.extend([info_logger, error_logger])
 
-    return info_logger, error_logger, access_logger
+    return info_logger, error_logger
@@ -0,0 +1,246 @@
+import asyncio
+import time
+
+from bisect import bisect_left
+from collections import defaultdict as dd
+
+import aioredis
+from aiojobs.aiohttp import get_scheduler_from_app
+
+from .exceptions import HTTPShieldedResource, ValidationError
+
+# in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    return ','.join(f'{name}="{escape_label(value)}"' for name, value in labels)
+
+
+class Histogram:
+    '''Fixed-bucket histogram. Only ever updated from the event loop's thread, hence no locking.'''
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last slot counts the observations past the largest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        '''Render in the Prometheus text exposition format, `labels` being a tuple of (name, value) pairs'''
+        prefix = format_labels(labels)
+        prefix = prefix + ',' if prefix else ''
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{prefix[:-1]}}} {self.sum}')
+        lines.append(f'{name}_count{{{prefix[:-1]}}} {self.count}')
+        return lines
+
+
+def render_gauges(prefix, label_name, stats, description=''):
+    '''Render `stats` - a dict of stats dicts by `label_name`'s values, or a single stats dict
+    if `label_name` is None - as one gauge per stat
+    '''
+    if label_name is None:
+        stats = {None: stats}
+    samples = dd(list)
+    for label_value, entity_stats in stats.items():
+        labels = '' if label_name is None else f'{{{format_labels(((label_name, label_value),))}}}'
+        for stat, value in entity_stats.items():
+            samples[stat].append(f'{prefix}_{stat}{labels} {value}')
+    lines = []
+    for stat, stat_samples in samples.items():
+        if description:
+            lines.append(f'# HELP {prefix}_{stat} {description}')
+        lines.append(f'# TYPE {prefix}_{stat} gauge')
+        lines.extend(stat_samples)
+    return lines
+
+
+class CounterFamily:
+    '''Counters of a single metric, by label values'''
+
+    def __init__(self, name, label_names, description=''):
+        self.name = name
+        self.label_names = label_names
+        self.description = description
+        self.counts = dd(int)
+
+    def inc(self, label_values, value=1):
+        self.counts[label_values] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} counter']
+        for label_values, count in self.counts.items():
+            lines.append(f'{self.name}{{{format_labels(zip(self.label_names, label_values))}}} {count}')
+        return lines
+
+
+class HistogramFamily:
+    '''Histograms of a single metric, by label values'''
+
+    def __init__(self, name, label_names, description='', buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.label_names = label_names
+        self.description = description
+        self.buckets = buckets
+        self.histograms = {}
+
+    def observe(self, label_values, value):
+        try:
+            histogram = self.histograms[label_values]
+        except KeyError:
+            histogram = self.histograms[label_values] = Histogram(self.buckets)
+        histogram.observe(value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        for label_values, histogram in self.histograms.items():
+            lines.extend(histogram.render(self.name, tuple(zip(self.label_names, label_values))))
+        return lines
+
+
+class PhaseTimings:
+    '''Per-phase latency histograms of the timed requests, by (view, operation, request type)'''
+
+    def __init__(self):
+        self.phases = HistogramFamily('postschema_request_phase_seconds',
+                                      ('view', 'op', 'request_type', 'phase'),
+                                      'Time spent by the requests in each of their phases')
+
+    def record(self, view, op, request_type, timer):
+        for phase, duration in timer.phases.items():
+            self.phases.observe((view, op, request_type, phase), duration)
+        self.phases.observe((view, op, request_type, 'total'), timer.elapsed())
+
+    def render(self):
+        return self.phases.render()
+
+
+class Metrics:
+    '''Request and Redis metrics, along with the app's resources' own counters, read at scrape time.
+
+    Same as the histograms, the counters are only ever updated from the event loop's thread.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self.requests = CounterFamily('postschema_requests_total',
+                                      ('view', 'op', 'request_type', 'status'),
+                                      'Requests served, by response status')
+        self.latency = HistogramFamily('postschema_request_seconds',
+                                       ('view', 'op', 'request_type'),
+                                       'Request latency')
+        self.validation_failures = CounterFamily('postschema_validation_failures_total',
+                                                 ('view', 'op'),
+                                                 'Requests rejected with validation errors')
+        self.shield_challenges = CounterFamily('postschema_shield_challenges_total',
+                                               ('view', 'op'),
+                                               'Requests challenged by a shield')
+        self.redis_latency = HistogramFamily('postschema_redis_seconds', ('command',),
+                                             'Redis command and pipeline latency')
+
+    def record(self, view, op, request_type, resp, duration):
+        # unhandled exceptions end up as 500s
+        status = resp.status if resp is not None else 500
+        self.requests.inc((view, op, request_type, status))
+        self.latency.observe((view, op, request_type), duration)
+        if isinstance(resp, ValidationError):
+            self.validation_failures.inc((view, op))
+        elif isinstance(resp, HTTPShieldedResource):
+            self.shield_challenges.inc((view, op))
+
+    def collect(self):
+        '''Render the gauges of the app's pools, scheduler and caches'''
+        app = self.app
+        commons = app.commons
+        pools = {'primary': app.db_pool.stats()}
+        for i, read_pool in enumerate(app.db_read_pools):
+            pools[f'replica{i}'] = read_pool.stats()
+        lines = render_gauges('postschema_db_pool', 'pool', pools, 'Database connection pool stats')
+
+        scheduler = get_scheduler_from_app(app)
+        if scheduler is not None:
+            lines.extend(render_gauges('postschema_scheduler', None, {
+                'active_jobs': scheduler.active_count,
+                'pending_jobs': scheduler.pending_count
+            }, 'Background job scheduler stats'))
+
+        caches = {}
+        for name in ('where_plans', 'response_cache', 'decrypt_cache', 'session_cache', 'statement_cache'):
+            cache = getattr(commons, name)
+            if cache is not None:
+                caches[name] = cache.stats()
+        lines.extend(render_gauges('postschema_cache', 'cache', caches, 'Cache stats'))
+        lines.extend(render_gauges('postschema_password_hasher', None, commons.password_hasher.stats(),
+                                   'Password hashing pool stats'))
+        lines.extend(render_gauges('postschema_access_log', None, commons.access_log.stats(),
+                                   'Access log buffer stats'))
+        return lines
+
+    def render(self):
+        lines = []
+        for family in (self.requests, self.latency, self.validation_failures,
+                       self.shield_challenges, self.redis_latency):
+            lines.extend(family.render())
+        lines.extend(self.collect())
+        return lines
+
+
+class InstrumentedRedis(aioredis.Redis):
+    '''Redis client timing its commands and pipelines into the `latency` histogram family'''
+
+    def __init__(self, pool_or_conn, latency=None):
+        # pipelines instantiate the class with no `latency`, over their command buffer
+        super().__init__(pool_or_conn)
+        self.latency = latency
+
+    def _observe(self, command, started_at):
+        self.latency.observe((command,), time.perf_counter() - started_at)
+
+    def execute(self, command, *args, **kwargs):
+        if self.latency is None:
+            return super().execute(command, *args, **kwargs)
+        started_at = time.perf_counter()
+        fut = asyncio.ensure_future(super().execute(command, *args, **kwargs))
+        if isinstance(command, bytes):
+            command = command.decode()
+        fut.add_done_callback(lambda _: self._observe(command.upper(), started_at))
+        return fut
+
+    def _timed_pipeline(self, pipe, label):
+        if self.latency is None:
+            return pipe
+        execute = pipe.execute
+
+        async def timed_execute(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return await execute(*args, **kwargs)
+            finally:
+                self._observe(label, started_at)
+
+        pipe.execute = timed_execute
+        return pipe
+
+    def pipeline(self):
+        return self._timed_pipeline(super().pipeline(), 'PIPELINE')
+
+    def multi_exec(self):
+        return self._timed_pipeline(super().multi_exec(), 'MULTI_EXEC')
@@ -1,10 +1,10 @@
 import os
+import time
 
 import pyotp
 from contextlib import asynccontextmanager, suppress
 
 from aiohttp import web
-from aiojobs.aiohttp import spawn
 from cryptography.fernet import InvalidToken
 
 with suppress(ImportError):
@@ -12,7 +12,11 @@ with suppress(ImportError):
 
 from . import ALLOWED_OPERATIONS
 from .auth.context import AuthContext
+from .db import RequestDB
 from .exceptions import HTTPShieldedResource
+from .logging import access_msg_context, request_log_context
+from .slow_queries import current_request
+from .timing import RequestTimer, request_timer, timed
 from .utils import generate_num_sequence
 from .view_bases import AuxViewBase
 
@@ -25,17 +29,33 @@ def set_init_logging_context(request):
     except (IndexError, AttributeError):
         IP = '0.0.0.0'
     request.IP = IP
+    request.started_at = time.monotonic()
+    # start afresh, should the task be reused across requests
+    request_log_context.set(None)
+    access_msg_context.set(None)
+    current_request.set(request)
 
 
 def set_logging_context(app, **context):
+    '''Set the request's logging context, merged into the entries of all the app's loggers.
+    Being held in a context variable, it's seen by the request's spawned jobs as well.
+    '''
     if 'sentry' in app.installed_plugins:
         with configure_scope() as scope:
             scope.user = context
     if 'id' in context:
         context['actor_id'] = context.pop('id')
-    app.info_logger = app.info_logger.renew(**context)
-    app.error_logger = app.error_logger.renew(**context)
-    app.access_logger = app.access_logger.renew(**context)
+    request_log_context.set(context)
+
+
+async def log_response(request, handler, resp):
+    with suppress(AttributeError):
+        # only the views define it
+        handler.log_request(request, resp)
+    on_response_done = request.app.config.on_response_done
+    if on_response_done is not None:
+        # run past the request's transaction, so that it sees the request's writes
+        request.db.after_close(on_response_done(request, resp))
 
 
 @asynccontextmanager
@@ -157,6 +177,53 @@ async def prepare_shielded_response(request, handler):
     return await handler(request)
 
 
+@web.middleware
+async def metrics_middleware(request, handler):
+    '''Count and time the requests into `commons.metrics`, and their phases (see `timing.timed`)
+    into `commons.phase_timings`, optionally sent back in the `Server-Timing` header
+    '''
+    config = request.app.config
+    metrics = request.app.commons.metrics
+    if not config.request_timing and metrics is None:
+        return await handler(request)
+
+    timer = RequestTimer()
+    if config.request_timing:
+        request_timer.set(timer)
+    resp = None
+    try:
+        resp = await handler(request)
+        return resp
+    except web.HTTPException as exc:
+        resp = exc
+        raise
+    finally:
+        view = getattr(request.match_info.handler, '__name__', 'unknown')
+        op = getattr(request, 'operation', request.method.lower())
+        request_type = getattr(getattr(request, 'session', None), 'request_type', 'public')
+        if metrics is not None:
+            metrics.record(view, op, request_type, resp, timer.elapsed())
+        if config.request_timing:
+            request.app.commons.phase_timings.record(view, op, request_type, timer)
+            if config.server_timing and resp is not None:
+                with suppress(RuntimeError):
+                    # streamed responses have their headers sent already
+                    resp.headers['Server-Timing'] = ', '.join(
+                        filter(None, [timer.server_timing(), f'total;dur={timer.elapsed() * 1000:.2f}']))
+
+
+@web.middleware
+async def db_middleware(request, handler):
+    request.db = RequestDB(request)
+    commit = False
+    try:
+        resp = await handler(request)
+        commit = resp.status < 400
+        return resp
+    finally:
+        await request.db.close(commit=commit)
+
+
 @web.middleware
 async def postschema_middleware(request, handler):
     request.handler = handler
@@ -170,7 +237,8 @@ async def postschema_middleware(request, handler):
         auth_ctxt.ip_address = request.IP
         request.session = auth_ctxt
         try:
-            await auth_ctxt.set_session_context()
+            with timed('session'):
+                await auth_ctxt.set_session_context()
         except web.HTTPUnauthorized as unauth_exc:
             request.session = {}
             request.session['actor_id'] = getattr(unauth_exc, 'actor_id', 'Unrecognized')
@@ -185,7 +253,8 @@ async def postschema_middleware(request, handler):
         auth_ctxt.request_type = 'public'
         auth_ctxt.ip_address = request.IP
         request.session = auth_ctxt
-        await auth_ctxt.set_session_context()
+        with timed('session'):
+            await auth_ctxt.set_session_context()
         return await handler(request)
     except TypeError:
         if 'roles' in handler._perm_options:
@@ -193,7 +262,8 @@ async def postschema_middleware(request, handler):
             auth_ctxt = AuthContext(request)
             auth_ctxt.request_type = 'authed'
             auth_ctxt.ip_address = request.IP
-            await auth_ctxt.set_session_context()
+            with timed('session'):
+                await auth_ctxt.set_session_context()
             if str(auth_ctxt.status) != '1':
                 raise web.HTTPForbidden(reason='Account inactive')
             request.session = auth_ctxt
@@ -201,15 +271,14 @@ async def postschema_middleware(request, handler):
                                 id=auth_ctxt['actor_id'],
                                 email=auth_ctxt['email'],
                                 workspace=auth_ctxt['workspace'])
-            auth_ctxt.authorize_standalone(**handler._perm_options)
+            with timed('authorize'):
+                auth_ctxt.authorize_standalone(**handler._perm_options)
 
             async with switch_workspace(request):
                 resp = await prepare_shielded_response(request, handler)
-                with suppress(AttributeError):
-                    await spawn(request, handler.log_request(request, resp))
-                    await spawn(request, request.app.config.on_response_done(request, resp))
+                await log_response(request, handler, resp)
 
-            resp.headers['ETag'] = request.app.spec_hash
+            resp.headers.setdefault('ETag', request.app.spec_hash)
             return resp
         raise
 
@@ -229,19 +298,16 @@ async def postschema_middleware(request, handler):
     auth_ctxt.set_level_permissions()
     auth_ctxt.ip_address = request.IP
     try:
-        await auth_ctxt.set_session_context()
+        with timed('session'):
+            await auth_ctxt.set_session_context()
     except web.HTTPException as err_resp:
         resp = err_resp
-        with suppress(AttributeError):
-            await spawn(request, handler.log_request(request, resp))
-            await spawn(request, request.app.config.on_response_done(request, resp))
+        await log_response(request, handler, resp)
         raise resp
 
     if auth_ctxt and str(auth_ctxt.status) != '1':
         resp = web.HTTPForbidden(reason='Account inactive')
-        await spawn(request, handler.log_request(request, resp))
-        with suppress(AttributeError):
-            await spawn(request, request.app.config.on_response_done(request, resp))
+        await log_response(request, handler, resp)
         raise resp
 
     extra_ctxt = {
@@ -254,18 +320,17 @@ async def postschema_middleware(request, handler):
     request.session = auth_ctxt
 
     async with switch_workspace(request):
-        request.auth_conditions = auth_ctxt.authorize()
+        with timed('authorize'):
+            request.auth_conditions = auth_ctxt.authorize()
         resp = None
         try:
             resp = await prepare_shielded_response(request, handler)
         except web.HTTPException as err_resp:
             resp = err_resp
-        with suppress(AttributeError):
-            if request.path not in ['/actor/logout/', '/actor/login/']:
-                await spawn(request, handler.log_request(request, resp))
-                await spawn(request, request.app.config.on_response_done(request, resp))       
+        if request.path not in ['/actor/logout/', '/actor/login/']:
+            await log_response(request, handler, resp)
 
-    resp.headers['ETag'] = request.app.spec_hash
+    resp.headers.setdefault('ETag', request.app.spec_hash)
     if request.session.delete_session_cookie:
         request.app.info_logger.info('Deleting session cookie')
         resp.del_cookie('postsession')
@@ -27,7 +27,7 @@ POSTGRES_ADMIN_PASSWORD = os.environ.get('POSTGRES_ADMIN_PASSWORD', POSTGRES_PAS
 POSTGRES_HOST = os.environ.get('POSTGRES_HOST')
 POSTGRES_PORT = os.environ.get('POSTGRES_PORT')
 
-info_logger, error_logger, _ = setup_logging()
+info_logger, error_logger = setup_logging()
 
 
 def get_url():
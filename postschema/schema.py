@@ -1,19 +1,68 @@
 import asyncio
 import itertools
 
+from contextvars import ContextVar
+
+from marshmallow.error_store import ErrorStore
 from marshmallow.schema import ValidationError, BaseSchema as MarshmallowBaseSchema, SchemaMeta
 from sqlalchemy.ext.declarative import declarative_base
 
 from .auth.perms import COMPOSITE_OPS, PublicPrivatePerms
+from .validators import FKResolver
 
 Base = declarative_base()
 
+validation_context = ContextVar('validation_context', default=None)
+
+
+class ValidationContext:
+    '''State of a single payload validation, kept off the schema instances,
+    as these are shared by all the concurrent requests.
+    '''
+    __slots__ = ('session', 'app', 'deferred', 'fk_resolver')
+
+    def __init__(self, request):
+        self.session = getattr(request, 'session', None)
+        self.app = request.app
+        self.fk_resolver = FKResolver(request)
+        # async validators called by the current `load()`, as (validator, fieldname, index)
+        self.deferred = []
+
+
+class ContextualSchemaMixin:
+    '''Exposes the current request's session and app to the schema's validators'''
+
+    @property
+    def session(self):
+        ctx = validation_context.get()
+        if ctx is None:
+            raise AttributeError('No validation in progress')
+        return ctx.session
+
+    @property
+    def app(self):
+        ctx = validation_context.get()
+        if ctx is None:
+            raise AttributeError('No validation in progress')
+        return ctx.app
+
+    @property
+    def fk_resolver(self):
+        ctx = validation_context.get()
+        if ctx is None:
+            raise AttributeError('No validation in progress')
+        return ctx.fk_resolver
+
 
 class DefaultMetaBase:
     enable_extended_search = False
     create_views = True
     excluded_ops = []
     exclude_from_updates = []
+    pagination = 'offset'
+    count = 'exact'
+    bulk_post_limit = 1000
+    cache = False
 
 
 class DefaultOperations:
@@ -58,7 +107,7 @@ class _schemascls:
 _schemas = _schemascls()
 
 
-class PostSchemaBase(MarshmallowBaseSchema):
+class PostSchemaBase(ContextualSchemaMixin, MarshmallowBaseSchema):
 
     Base = Base
 
@@ -70,17 +119,13 @@ class PostSchemaBase(MarshmallowBaseSchema):
         self._autosession_fields = autosession_fields
         self._joinable_fields = joinable = set(joins or [])
         self._default_joinable_tables = only & joinable
-        self._deferred_async_validators = []
         self.parent = self.__class__.__base__
 
     def _call_and_store(self, getter_func, data, *, field_name, error_store, index=None):
         if asyncio.iscoroutinefunction(getter_func):
-            getter_func.__func__.__postschema_hooks__ = {
-                'fieldname': field_name,
-                'error_store': error_store,
-                'index': index
-            }
-            self._deferred_async_validators.append(getter_func)
+            ctx = validation_context.get()
+            if ctx is not None:
+                ctx.deferred.append((getter_func, field_name, index))
             return data
         return MarshmallowBaseSchema._call_and_store(
             getter_func=getter_func,
@@ -90,20 +135,27 @@ class PostSchemaBase(MarshmallowBaseSchema):
             index=index)
 
     async def run_async_validators(self, data):
-        for async_validator in self._deferred_async_validators:
-            hooks = async_validator.__postschema_hooks__
-            fieldname = hooks['fieldname']
-            try:
-                await async_validator(data[fieldname])
-                return {}
-            except KeyError:
-                pass
-            except ValidationError as inner_merr:
-                inner_emsgs = inner_merr.messages
-                index = hooks['index']
-                error_store = hooks['error_store']
-                error_store.store_error(inner_emsgs, fieldname, index=index)
-                return error_store.errors
+        '''Run the async validators deferred by the current `load()`, all at once'''
+        ctx = validation_context.get()
+        if ctx is None:
+            return {}
+
+        # validators of the nested schemas are left out, as they don't apply to `data`
+        validators = [
+            (validator, fieldname, index) for validator, fieldname, index in ctx.deferred
+            if validator.__self__ is self and fieldname in data
+        ]
+        results = await asyncio.gather(
+            *(validator(data[fieldname]) for validator, fieldname, _ in validators),
+            return_exceptions=True)
+
+        error_store = ErrorStore()
+        for (_, fieldname, index), result in zip(validators, results):
+            if isinstance(result, ValidationError):
+                error_store.store_error(result.messages, fieldname, index=index)
+            elif isinstance(result, BaseException):
+                raise result
+        return error_store.errors
 
     @property
     def is_read_schema(self):
@@ -151,6 +203,31 @@ class PostSchemaMeta(SchemaMeta):
         for k, v in new_attrs.items():
             setattr(kls, k, v)
 
+    def _expand_access_logging_ops(kls, attr, conf, all_ops):
+        '''Normalize an `AccessLogging` attribute into a mapping of concrete operation names to values.
+        `conf` is either a list of operations (or `'*'`), taking the value of 1, or a mapping
+        of operations to values, where `'*'` stands for the default.
+        Explicitly listed operations win over the composite ones.
+        '''
+        if isinstance(conf, dict):
+            explicit = dict(conf)
+        elif conf in ['*', ['*']]:
+            explicit = {'*': 1.0}
+        else:
+            explicit = dict.fromkeys(conf, 1.0)
+        default = explicit.pop('*', None)
+        common_ops = set(explicit) & all_ops
+        assert default is not None or common_ops, \
+            f'{kls.__module__}.{kls.__name__}.AccessLogging.{attr} does not include any valid operation names'
+
+        expanded = {}
+        if default is not None:
+            concrete_ops = itertools.chain.from_iterable([COMPOSITE_OPS.get(op, [op]) for op in all_ops])
+            expanded = dict.fromkeys(concrete_ops, default)
+        for op in sorted(common_ops, key=lambda op: op not in COMPOSITE_OPS):
+            expanded.update(dict.fromkeys(COMPOSITE_OPS.get(op, [op]), explicit[op]))
+        return expanded
+
     def _parse_access_logging_class(kls):
         log_cls = getattr(kls, 'AccessLogging', None)
         all_ops = set(PublicPrivatePerms.__annotations__)
@@ -159,22 +236,26 @@ class PostSchemaMeta(SchemaMeta):
             authed_log_conf = getattr(log_cls, 'authed', [])
             assert any([authed_log_conf, public_log_conf]),\
                 f'{kls.__module__}.{kls.__name__}.AccessLogging needs to define at least one attribute named `public` or `authed`'
-            if public_log_conf:
-                if public_log_conf in ['*', ['*']]:
-                    log_cls.public = list(all_ops)
-                else:
-                    common_ops = set(public_log_conf) & all_ops
-                    assert common_ops, f'{kls.__module__}.{kls.__name__}.AccessLogging.public does not include any valid operation names'
-                    redacted_op_names = itertools.chain.from_iterable([COMPOSITE_OPS.get(op, [op]) for op in common_ops])
-                    log_cls.public = list(redacted_op_names)
-            if authed_log_conf:
-                if authed_log_conf in ['*', ['*']]:
-                    log_cls.authed = list(all_ops)
-                else:
-                    common_ops = set(authed_log_conf) & all_ops
-                    assert common_ops, f'{kls.__module__}.{kls.__name__}.AccessLogging.authed does not include any valid operation names'
-                    redacted_op_names = itertools.chain.from_iterable([COMPOSITE_OPS.get(op, [op]) for op in common_ops])
-                    log_cls.authed = list(redacted_op_names)
+            # operation -> sampling rate
+            log_cls.public = kls._expand_access_logging_ops('public', public_log_conf, all_ops) \
+                if public_log_conf else {}
+            log_cls.authed = kls._expand_access_logging_ops('authed', authed_log_conf, all_ops) \
+                if authed_log_conf else {}
+            for rate in itertools.chain(log_cls.public.values(), log_cls.authed.values()):
+                assert 0 <= rate <= 1, \
+                    f'{kls.__module__}.{kls.__name__}.AccessLogging sampling rates need to be between 0 and 1'
+
+            # operation -> seconds
+            slow_threshold = getattr(log_cls, 'slow_threshold', None)
+            # retyped schemas get parsed again, with the attribute already normalized
+            if slow_threshold is None or slow_threshold == {}:
+                log_cls.slow_threshold = {}
+            else:
+                if not isinstance(slow_threshold, dict):
+                    slow_threshold = {'*': slow_threshold}
+                log_cls.slow_threshold = kls._expand_access_logging_ops('slow_threshold', slow_threshold,
+                                                                        all_ops)
+            log_cls.always_log_errors = getattr(log_cls, 'always_log_errors', True)
 
 
 class PostSchema(PostSchemaBase, metaclass=PostSchemaMeta):
@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from contextlib import suppress
+
+INVALIDATION_CHANNEL = 'postschema:session:invalidate'
+
+
+class SessionCache:
+    '''In-process TTL/LRU cache of the actors' session contexts, as read from Redis.
+
+    Entries get evicted on changes to the underlying Redis keys, announced
+    over the `INVALIDATION_CHANNEL` pub/sub channel, so that all the processes
+    drop their copies. The TTL bounds the staleness should a message get lost.
+    '''
+
+    def __init__(self, app, maxsize=10000, ttl=30):
+        self.app = app
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # bumped on every invalidation, to discard results of reads racing with it
+        self.generation = 0
+        # entries are only served while invalidations are being received
+        self.listening = False
+        self._listener = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, actor_id):
+        if not self.listening:
+            return None
+        try:
+            expires_at, entry = self._entries[actor_id]
+        except KeyError:
+            self.misses += 1
+            return None
+        if expires_at < time.monotonic():
+            self._entries.pop(actor_id, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(actor_id)
+        self.hits += 1
+        return entry
+
+    def set(self, actor_id, entry, generation):
+        if generation != self.generation:
+            # an invalidation arrived while the entry was being read
+            return
+        self._entries[actor_id] = (time.monotonic() + self.ttl, entry)
+        self._entries.move_to_end(actor_id)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries)
+        }
+
+    def evict(self, *actor_ids):
+        self.generation += 1
+        for actor_id in actor_ids:
+            self._entries.pop(str(actor_id), None)
+
+    def clear(self):
+        self.generation += 1
+        self._entries.clear()
+
+    async def invalidate(self, *actor_ids):
+        '''Evict the entries locally and announce it to the other processes'''
+        self.evict(*actor_ids)
+        for actor_id in actor_ids:
+            await self.app.redis_cli.publish(INVALIDATION_CHANNEL, str(actor_id))
+
+    async def _listen(self):
+        while True:
+            try:
+                channel, = await self.app.redis_cli.subscribe(INVALIDATION_CHANNEL)
+                # messages published while unsubscribed are gone, start afresh
+                self.clear()
+                self.listening = True
+                while await channel.wait_message():
+                    actor_id = await channel.get(encoding='utf-8')
+                    self.evict(actor_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.app.error_logger.exception('Session cache invalidation listener failed')
+            self.listening = False
+            self.clear()
+            await asyncio.sleep(1)
+
+    def start(self):
+        self._listener = asyncio.ensure_future(self._listen())
+
+    async def stop(self):
+        self.listening = False
+        if self._listener is not None:
+            self._listener.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._listener
+            with suppress(Exception):
+                await self.app.redis_cli.unsubscribe(INVALIDATION_CHANNEL)
@@ -1,5 +1,11 @@
 from collections import defaultdict as dd
 
+# derived operations are shielded just like the ones they stem from
+DERIVED_OPS = {
+    'post': 'post_many',
+    'list': 'export'
+}
+
 
 def install(app):
     system_roles = app.config.roles
@@ -42,5 +48,7 @@ def install(app):
                         raise ValueError(
                             f'{schema_inst.__module__}.{schema_inst.__name__}.Shield.{op} defines an invalid shield method (can be "otp" or "sms")')
                     local_shields[op].append([allowed_roles, shield_op])
+            local_shields.update({derived_op: local_shields[op] for op, derived_op in DERIVED_OPS.items()
+                                  if op in local_shields})
             shields[schema_name] = dict(local_shields)
     app.shields = shields
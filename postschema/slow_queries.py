@@ -0,0 +1,145 @@
+import random
+import re
+import time
+
+from contextvars import ContextVar
+
+from aiojobs.aiohttp import get_scheduler_from_app
+
+# set by `postschema_middleware`, to attribute the slow queries to their view/operation
+current_request = ContextVar('current_request', default=None)
+
+STRING_LITERAL_PAT = re.compile(r"'(?:[^']|'')*'")
+PARAM_PAT = re.compile(r'%\(\w+\)s|%s|\$\d+')
+NUMBER_PAT = re.compile(r'\b\d+(?:\.\d+)?\b')
+VALUE_LIST_PAT = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+ROW_LIST_PAT = re.compile(r'\(\?\)(?:\s*,\s*\(\?\))+')
+WHITESPACE_PAT = re.compile(r'\s+')
+
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def redact_plan(node):
+    '''Replace the literals found in `EXPLAIN (FORMAT JSON)` output's strings (e.g. `Filter`,
+    `Index Cond`) with `?`, as the plan gets explained with the actual values bound
+    '''
+    if isinstance(node, dict):
+        return {key: redact_plan(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [redact_plan(value) for value in node]
+    if isinstance(node, str):
+        return NUMBER_PAT.sub('?', STRING_LITERAL_PAT.sub('?', node))
+    return node
+
+
+def normalize_query(query):
+    '''Reduce `query` to its shape, with the literals and parameters replaced by `?`'''
+    shape = STRING_LITERAL_PAT.sub('?', query)
+    shape = PARAM_PAT.sub('?', shape)
+    shape = NUMBER_PAT.sub('?', shape)
+    shape = VALUE_LIST_PAT.sub('(?)', shape)
+    # multi-row VALUES
+    shape = ROW_LIST_PAT.sub('(?)', shape)
+    return WHITESPACE_PAT.sub(' ', shape).strip()
+
+
+class SlowQueryLog:
+    '''Logs the queries taking `threshold` seconds or more, keeping a table of the `maxsize`
+    worst shapes by total time spent.
+
+    An `explain_rate` fraction of the slow shapes, drawn once per shape, gets its plan captured with
+    `EXPLAIN (FORMAT JSON)`, run by a background job on a separate connection. Values are never kept:
+    only the shapes are, and the plans get the literals redacted.
+    '''
+
+    def __init__(self, app, threshold, maxsize=100, explain_rate=0.0):
+        self.app = app
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.explain_rate = explain_rate
+        self._shapes = {}
+
+    def _entry(self, shape):
+        try:
+            return self._shapes[shape]
+        except KeyError:
+            pass
+        if len(self._shapes) >= self.maxsize:
+            least = min(self._shapes, key=lambda key: self._shapes[key]['total'])
+            del self._shapes[least]
+        entry = self._shapes[shape] = {
+            'shape': shape,
+            'count': 0,
+            'total': 0.0,
+            'max': 0.0,
+            'last_seen': None,
+            'views': {},
+            'plan': None,
+            'explained_at': None,
+            'explain': random.random() < self.explain_rate,
+            'explaining': False
+        }
+        return entry
+
+    async def observe(self, query, params, duration):
+        if duration < self.threshold:
+            return
+
+        request = current_request.get()
+        if request is not None:
+            view = getattr(request.match_info.handler, '__name__', 'unknown')
+            op = getattr(request, 'operation', request.method.lower())
+            origin = f'{view}:{op}'
+        else:
+            origin = 'background'
+
+        shape = normalize_query(query)
+        entry = self._entry(shape)
+        entry['count'] += 1
+        entry['total'] += duration
+        entry['max'] = max(entry['max'], duration)
+        entry['last_seen'] = time.time()
+        entry['views'][origin] = entry['views'].get(origin, 0) + 1
+        self.app.info_logger.warning('Slow query', shape=shape, origin=origin, duration=round(duration, 6))
+
+        if (entry['explain'] and entry['plan'] is None and not entry['explaining']
+                and shape.upper().startswith(EXPLAINABLE)):
+            entry['explaining'] = True
+            await get_scheduler_from_app(self.app).spawn(self._explain(entry, query, params))
+
+    async def _explain(self, entry, query, params):
+        # plain EXPLAIN doesn't run the statement, so writes are safe to explain as well
+        is_read = entry['shape'].upper().startswith('SELECT')
+        pool = self.app.commons.read_pool() if is_read else self.app.db_pool
+        try:
+            async with pool.acquire() as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(f'EXPLAIN (FORMAT JSON) {query}', params)
+                    plan, = await cur.fetchone()
+        except Exception:
+            # not to be retried on every occurrence
+            entry['explain'] = False
+            self.app.error_logger.exception('Failed to explain slow query', shape=entry['shape'])
+        else:
+            entry['plan'] = redact_plan(plan)
+            entry['explained_at'] = time.time()
+        finally:
+            entry['explaining'] = False
+
+    def top(self, limit=None):
+        '''The slow shapes, worst first'''
+        entries = sorted(self._shapes.values(), key=lambda entry: entry['total'], reverse=True)
+        return [{
+            'shape': entry['shape'],
+            'count': entry['count'],
+            'total': entry['total'],
+            'mean': entry['total'] / entry['count'],
+            'max': entry['max'],
+            'last_seen': entry['last_seen'],
+            'views': entry['views'],
+            'plan': entry['plan'],
+            'explained_at': entry['explained_at']
+        } for entry in entries[:limit]]
+
+    def reset(self):
+        self._shapes.clear()
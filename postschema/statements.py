@@ -0,0 +1,198 @@
+import re
+from collections import OrderedDict
+from collections.abc import Mapping
+from hashlib import md5
+from weakref import WeakKeyDictionary
+
+from psycopg2 import errors as postgres_errors
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+NAMED_PARAM_PAT = re.compile(r'%\((\w+)\)s|%%')
+
+
+def to_positional(query):
+    '''Translate pyformat placeholders (`%(name)s`) into positional ones (`$n`),
+    as expected by PREPARE. Return the translated query and the ordered parameter names.
+    '''
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name is None:
+            # escaped percent sign
+            return '%'
+        if name not in names:
+            names.append(name)
+        return f'${names.index(name) + 1}'
+
+    return NAMED_PARAM_PAT.sub(replace, query), names
+
+
+class StatementCache:
+    '''Per-connection cache of server-side prepared statements.
+
+    Statements are keyed by the final query text, which - with all the values passed as parameters -
+    reflects the query's shape only (template, where keys, joins).
+    Each connection keeps its own bounded LRU of statement names. Since the bookkeeping is held
+    against the connection object, a connection recycled by the pool takes its entries with it.
+    '''
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._prepared = WeakKeyDictionary()
+        # shapes Postgres refused to prepare (e.g. parameter types impossible to infer)
+        self._unpreparable = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _connection_cache(self, conn):
+        try:
+            return self._prepared[conn]
+        except KeyError:
+            self._prepared[conn] = cache = OrderedDict()
+            return cache
+
+    def invalidate(self, conn):
+        self._prepared.pop(conn, None)
+
+    def _mark_unpreparable(self, query):
+        self._unpreparable[query] = True
+        if len(self._unpreparable) > self.maxsize:
+            self._unpreparable.popitem(last=False)
+
+    async def _prepare(self, cur, cache, query):
+        name = f'postschema_{md5(query.encode()).hexdigest()}'
+        positional_query, param_names = to_positional(query)
+        try:
+            await cur.execute(f'PREPARE {name} AS {positional_query}')
+        except postgres_errors.DuplicatePreparedStatement:
+            # prepared on this session before its bookkeeping was lost
+            pass
+        except postgres_errors.Error:
+            self._mark_unpreparable(query)
+            return None
+
+        cache[query] = (name, param_names)
+        if len(cache) > self.maxsize:
+            _, (evicted_name, _) = cache.popitem(last=False)
+            await cur.execute(f'DEALLOCATE {evicted_name}')
+        return name, param_names
+
+    async def execute(self, cur, query, params=None):
+        params = params or {}
+        conn = cur.connection
+        if (not isinstance(params, Mapping)
+                or query in self._unpreparable
+                or conn.raw.get_transaction_status() != TRANSACTION_STATUS_IDLE):
+            # preparing inside a transaction risks aborting it, should PREPARE fail
+            return await cur.execute(query, params)
+
+        cache = self._connection_cache(conn)
+        try:
+            statement = cache[query]
+            cache.move_to_end(query)
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            statement = await self._prepare(cur, cache, query)
+            if statement is None:
+                return await cur.execute(query, params)
+
+        name, param_names = statement
+        placeholders = ','.join(['%s'] * len(param_names))
+        execute_stmt = f'EXECUTE {name} ({placeholders})' if param_names else f'EXECUTE {name}'
+        try:
+            return await cur.execute(execute_stmt, [params[pname] for pname in param_names])
+        except postgres_errors.InvalidSqlStatementName:
+            # the session lost its prepared statements (e.g. server-side reset), start over
+            self.invalidate(conn)
+            return await cur.execute(query, params)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': sum(len(cache) for cache in list(self._prepared.values()))
+        }
+
+
+# steps extracting the values of a `WherePlan`
+DROP = 0        # pop the key, its value goes unused
+POP = 1         # pop the key, its value goes under `target`
+SPREAD = 2      # pop the key, each of its value's items goes under `{target}_{subkey}`
+EXTENDED = 3    # pop the key, its value is formatted with `extra` or split into lower/upper bounds
+COPY = 4        # leave the key, its value goes under `target`
+
+
+class WherePlan:
+    '''Outcome of assembling a query's WHERE clause (with its joins, usings and froms)
+    for a given payload shape: the final query text and the steps extracting its values off a payload.
+    '''
+
+    __slots__ = ('query', 'steps', 'open_clauses')
+
+    def __init__(self, query, steps, open_clauses=False):
+        self.query = query
+        self.steps = steps
+        self.open_clauses = open_clauses
+
+    def extract(self, payload, extra_values=None):
+        '''Consume `payload` the way the query was built for, returning the query's values'''
+        values = {}
+        for step, key, target, extra in self.steps:
+            if step == COPY:
+                values[target] = payload[key]
+            elif step == POP:
+                values[target] = payload.pop(key)
+            elif step == SPREAD:
+                for subkey, val in payload.pop(key).items():
+                    values[f'{target}_{subkey}'] = val
+            elif step == EXTENDED:
+                value = payload.pop(key)
+                if isinstance(value, list):
+                    values[f'{target}_lower'] = value[0]
+                    values[f'{target}_upper'] = value[1]
+                else:
+                    values[target] = extra.format(val=value)
+            else:
+                payload.pop(key, None)
+        if self.open_clauses:
+            # open clauses take the remaining payload as is
+            values = payload
+        if extra_values:
+            values.update(extra_values)
+        return self.query, values
+
+
+class PlanCache:
+    '''Bounded LRU of compiled `WherePlan`s, keyed by the request's shape'''
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._plans = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            plan = self._plans[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._plans.move_to_end(key)
+        self.hits += 1
+        return plan
+
+    def set(self, key, plan):
+        if not self.maxsize:
+            return
+        self._plans[key] = plan
+        if len(self._plans) > self.maxsize:
+            self._plans.popitem(last=False)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._plans)
+        }
@@ -0,0 +1,42 @@
+import time
+
+from collections import defaultdict as dd
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# set by `metrics_middleware` for the request's duration
+request_timer = ContextVar('request_timer', default=None)
+
+
+class RequestTimer:
+    '''Accumulates the time spent by a request in each of its phases'''
+
+    __slots__ = ('started_at', 'phases')
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases = dd(float)
+
+    def add(self, phase, duration):
+        self.phases[phase] += duration
+
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    def server_timing(self):
+        '''Render the phases as a `Server-Timing` header value, in milliseconds'''
+        return ', '.join(f'{phase};dur={duration * 1000:.2f}' for phase, duration in self.phases.items())
+
+
+@contextmanager
+def timed(phase):
+    '''Add the time spent in the block to the current request's `phase`, if the request is being timed'''
+    timer = request_timer.get()
+    if timer is None:
+        yield
+        return
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(phase, time.perf_counter() - started_at)
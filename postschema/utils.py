@@ -1,12 +1,15 @@
+import base64
+import binascii
 import json
 import string
 import re
 import random
 import secrets
+from decimal import Decimal
 
 import orjson
 from aiohttp import web
-from psycopg2.extras import Json as PsycopJson
+from psycopg2.extras import Json as PsycopJson, Range
 
 
 NUMSET = list(string.digits)
@@ -18,6 +21,8 @@ PG_CONSTR_PAT = re.compile(
     r'constraint \"(?P<constraint>\w+)\"'
 )
 ORJSON_FLAGS = orjson.OPT_OMIT_MICROSECONDS | orjson.OPT_SERIALIZE_UUID | orjson.OPT_UTC_Z
+# range bounds containing these get double-quoted in Postgres' output
+RANGE_QUOTED_CHARS = frozenset('"\\,()[] \t\n')
 
 
 def def_dump(val):
@@ -26,17 +31,64 @@ def def_dump(val):
     return json.dumps(str(val))
 
 
-def dumps(val):
+def _range_bound(val):
+    if val is None:
+        return ''
+    text = str(val)
+    if not text or RANGE_QUOTED_CHARS.intersection(text):
+        return '"{}"'.format(text.replace('\\', '\\\\').replace('"', '\\"'))
+    return text
+
+
+def orjson_default(val):
+    '''Serialize the types orjson doesn't know of, mirroring how Postgres outputs them'''
+    if isinstance(val, (set, frozenset)):
+        # e.g. `BracketedFrozenset`
+        return list(val)
+    if isinstance(val, Decimal):
+        return str(val)
+    if isinstance(val, Range):
+        # e.g. `["2020-01-01 00:00:00","2020-01-02 00:00:00")` or `empty`
+        if val.isempty:
+            return 'empty'
+        lower = '[' if val.lower_inc else '('
+        upper = ']' if val.upper_inc else ')'
+        return f'{lower}{_range_bound(val.lower)},{_range_bound(val.upper)}{upper}'
+    return str(val)
+
+
+def dumpb(val):
     try:
-        return orjson.dumps(val, option=ORJSON_FLAGS).decode()
+        return orjson.dumps(val, default=orjson_default, option=ORJSON_FLAGS)
     except orjson.JSONEncodeError:
-        return json.dumps(val, default=def_dump)
+        # e.g. non-string keys or integers exceeding 64 bits
+        return json.dumps(val, default=def_dump).encode()
+
+
+def dumps(val):
+    return dumpb(val).decode()
 
 
 def Json(val):
     return PsycopJson(val, dumps=dumps)
 
 
+def encode_cursor(values):
+    '''Wrap the seek values of the last row into an opaque, url-safe token'''
+    return base64.urlsafe_b64encode(orjson.dumps(values)).decode()
+
+
+def decode_cursor(cursor, length):
+    '''Unwrap the token produced by `encode_cursor`, ensuring it carries `length` values'''
+    try:
+        values = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError('Invalid cursor')
+    return values
+
+
 def generate_random_word(ln=10):
     return secrets.token_urlsafe(ln)
 
@@ -45,9 +97,10 @@ def generate_num_sequence(ln=4):
     return ''.join(random.sample(NUMSET, ln))
 
 
-def json_response(data, **kwargs):
-    kwargs.setdefault("dumps", dumps)
-    return web.json_response(data, **kwargs)
+def json_response(data, dumps=None, content_type='application/json', **kwargs):
+    '''Like `web.json_response`, only passing the orjson bytes straight to the body'''
+    body = dumpb(data) if dumps is None else dumps(data).encode()
+    return web.Response(body=body, content_type=content_type, **kwargs)
 
 
 def parse_postgres_err(perr):
@@ -1,7 +1,88 @@
+import asyncio
+
 from marshmallow import ValidationError
 from .utils import Json
 
 
+def to_array_literal(values):
+    '''Render `values` as a Postgres array literal. Passed as a parameter, it gets
+    coerced to the array type of the column it's compared against.'''
+    quoted = ('"{}"'.format(str(val).replace('\\', '\\\\').replace('"', '\\"')) for val in values)
+    return '{' + ','.join(quoted) + '}'
+
+
+class FKResolver:
+    '''Batches the FK existence checks requested by the async validators of a single payload.
+
+    Validators run concurrently, so all of them get to register their checks before
+    the flush (scheduled by the first one) runs them all, in a single `UNION ALL` query.
+    '''
+
+    def __init__(self, request):
+        self.request = request
+        self.app = request.app
+        self._checks = []
+        self._flush_handle = None
+        # the flushes in flight, referenced until done so they can't get garbage-collected
+        self._flushes = set()
+
+    async def resolve(self, tablename, target_col, ids, where=None):
+        """Return these of `ids` found in `tablename`'s `target_col`,
+        optionally narrowed down by a `(column, value)` pair."""
+        future = asyncio.get_event_loop().create_future()
+        self._checks.append((tablename, target_col, [str(i) for i in ids], where, future))
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_soon(self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        flush = asyncio.ensure_future(self._flush())
+        self._flushes.add(flush)
+        flush.add_done_callback(self._flushes.discard)
+
+    @staticmethod
+    def _render_checks(checks):
+        '''Render `checks` into a single query, returning the query and its values'''
+        selects = []
+        values = {}
+        for idx, (tablename, target_col, ids, where, _) in enumerate(checks):
+            stmt = (f'SELECT {idx} AS idx, {target_col}::text AS fk FROM "{tablename}" '
+                    f'WHERE {target_col}=ANY(%(fk_{idx})s)')
+            values[f'fk_{idx}'] = to_array_literal(ids)
+            if where is not None:
+                where_col, values[f'fk_where_{idx}'] = where
+                stmt += f' AND {where_col}=%(fk_where_{idx})s'
+            selects.append(stmt)
+        return ' UNION ALL '.join(selects), values
+
+    async def _flush(self):
+        checks, self._checks, self._flush_handle = self._checks, [], None
+        query, values = self._render_checks(checks)
+
+        found = [set() for _ in checks]
+        try:
+            async with self.request.db.acquire() as conn:
+                async with conn.cursor() as cur:
+                    try:
+                        await self.app.commons.run_query(cur, query, values)
+                    except Exception:
+                        self.app.error_logger.exception('Failed to execute FKs checking query',
+                                                        query=cur.query.decode())
+                        raise
+                    for idx, fk in await cur.fetchall():
+                        found[idx].add(fk)
+        except Exception as exc:
+            for *_, future in checks:
+                # its validator might have been cancelled in the meantime
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for (*_, future), existing in zip(checks, found):
+            if not future.done():
+                future.set_result(existing)
+
+
 def must_not_be_empty(val):
     if not val:
         raise ValidationError('Data not provided')
@@ -24,22 +105,10 @@ def adjust_children_field(fieldname):
         if self.is_read_schema or not value or not value[0]:
             return
         target_table = self.declared_fields[fieldname].target_table
-        table_name = target_table['name']
-        target_col = target_table['target_col']
-        ids = ','.join(value)
-        query = f"SELECT COALESCE(json_agg(id::text), '[]'::json) FROM \"{table_name}\" WHERE {target_col}=ANY('{{{ids}}}')"
-        async with self.app.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                try:
-                    await cur.execute(query)
-                except Exception:
-                    self.app.error_logger.exception('Failed to execute FKs checking query',
-                                                    query=cur.query.decode())
-                    raise
-                res = (await cur.fetchone())[0]
-                invalid_pks = set(value) - set(res)
-                if invalid_pks:
-                    raise ValidationError(f'Foreign keys not found: {", ".join(map(str, invalid_pks))}')
+        existing = await self.fk_resolver.resolve(target_table['name'], target_table['target_col'], value)
+        invalid_pks = set(map(str, value)) - existing
+        if invalid_pks:
+            raise ValidationError(f'Foreign keys not found: {", ".join(invalid_pks)}')
     return validator_template, make_children_post_load
 
 
@@ -53,16 +122,7 @@ def autosession_field_validator(fieldname):
         target_col = fieldval.target_table['target_col']
         colname = fieldval.target_column
         sessval = self.session[fieldval.session_field]
-        query = f'SELECT 1 FROM "{tablename}" WHERE {colname}=%s AND {target_col}=%s'
-
-        async with self.app.db_pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                try:
-                    await cur.execute(query, [sessval, val])
-                except Exception:
-                    self.app.error_logger.exception('Failed to execute an FK checking query',
-                                                    query=cur.query.decode())
-                    raise
-                if not await cur.fetchone():
-                    raise ValidationError(f'Foreign key doesn\'t exist or no sufficient permissions held.')
+
+        if not await self.fk_resolver.resolve(tablename, target_col, [val], where=(colname, sessval)):
+            raise ValidationError(f'Foreign key doesn\'t exist or no sufficient permissions held.')
     return _autosession_field_validator
@@ -1,14 +1,15 @@
 import weakref
 
 from contextlib import suppress
+from functools import partial
 
 from aiohttp import web
-from aiojobs.aiohttp import spawn
 from marshmallow import ValidationError
 
 from . import exceptions as post_exceptions
+from .logging import access_msg_context
 from .utils import json_response
-from .view_bases import AuxViewMeta
+from .view_bases import EXPORT_FORMATS, AuxViewMeta
 
 
 class ViewsTemplate:
@@ -74,27 +75,51 @@ class ViewsTemplate:
                 unified_order_field = unified_order_field[0].split(',')
             get_query['order_by'] = unified_order_field
 
+        streaming = 'application/x-ndjson' in self.request.headers.get('Accept', '')
         base_stmt = await self._parse_select_fields(
-            get_query, self._prepare_list_query) or self.list_query_stmt
+            get_query, partial(self._prepare_list_query, streaming=streaming)) \
+            or (self.list_stream_query_stmt if streaming else self.list_query_stmt)
 
         pagination_data = await self._validate_singular_payload(
             get_query or {}, self.pagination_schema, 'query')
-        limit = pagination_data['limit']
-        page = pagination_data['page'] - 1
-        offset = page * limit
+
+        if hasattr(self.schema, 'before_list'):
+            cleaned_payload = await self.schema.before_list(self.request, cleaned_payload) or cleaned_payload
+
+        list_handler = self._list_handlers['stream' if streaming else self.pagination_mode]
+        return await list_handler(self, cleaned_payload, base_stmt, pagination_data)
+
+    async def export(self):
+        cleaned_payload = await self._validate_singular_payload()
+        self.cleaned_payload_keys = list(cleaned_payload) or []
+
+        get_query_raw = self.request.query
+        get_query = dict(get_query_raw)
+        export_format = get_query.pop('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            raise post_exceptions.ValidationError({
+                'query': {'format': [f"Must be one of: {', '.join(EXPORT_FORMATS)}"]}})
+
+        if 'order_by' in get_query:
+            unified_order_field = get_query_raw.getall('order_by')
+            if ',' in unified_order_field[0]:
+                unified_order_field = unified_order_field[0].split(',')
+            get_query['order_by'] = unified_order_field
+
+        base_stmt = await self._parse_select_fields(
+            get_query, self._prepare_export_query) or self.export_query_stmt
+
+        # only the ordering applies, the export covers the whole filtered result
+        pagination_data = await self._validate_singular_payload(
+            get_query or {}, self.pagination_schema, 'query')
         orderby = ','.join(f'"{self.tablename}".{field}' for field in pagination_data['order_by'])
         orderhow = pagination_data['order_dir'].upper()
 
         if hasattr(self.schema, 'before_list'):
             cleaned_payload = await self.schema.before_list(self.request, cleaned_payload) or cleaned_payload
 
-        query = base_stmt.format(
-            limit=limit,
-            offset=offset,
-            orderby=orderby,
-            orderhow=orderhow)
-
-        return await self._fetch(cleaned_payload, query)
+        return await self._copy_export(
+            cleaned_payload, base_stmt.format(orderby=orderby, orderhow=orderhow), export_format)
 
     async def post(self):
         # get the payload
@@ -112,25 +137,60 @@ class ViewsTemplate:
 
         insert_query = self._render_insert_query(cleaned_payload)
 
-        async with self.request.app.db_pool.acquire() as conn:
+        async with self.request.db.acquire() as conn:
             async with conn.cursor() as cur:
-                await self.request.app.commons.execute(cur, insert_query, cleaned_payload)
+                await self.request.app.commons.execute(cur, insert_query, cleaned_payload, prepare=True)
                 res = await cur.fetchone()
                 if res is None:
                     if self.request.session:
                         # Most likely a cross workspace insert or non-existent FK
                         raise web.HTTPConflict(reason='Illegal cross workspace insert or non-existent FK supplied')
 
-                    self.request.app.access_logger = self.request.app.access_logger.bind(msg_context={
+                    access_msg_context.set({
                         'query': cur.query.decode()
                     })
                     raise post_exceptions.CreateFailed()
 
         if hasattr(self.schema, 'after_post'):
-            await spawn(self.request, self.schema.after_post(self.request, cleaned_payload, res[0]))
+            self.request.db.after_commit(self.schema.after_post(self.request, cleaned_payload, res[0]))
 
         return json_response({self.pk_column_name: res[0]})
 
+    async def post_many(self):
+        payloads = await self.payload
+        with suppress(AttributeError):
+            payloads = [await self.schema.procure_payload(self.request, payload) for payload in payloads]
+
+        cleaned_payloads = []
+        for cleaned_payload in await self._validate_many_payload(payloads):
+            cleaned_payload = self._clean_write_payload(cleaned_payload)
+            if hasattr(self.schema, 'before_post'):
+                cleaned_payload = await self.schema.before_post(
+                    weakref.proxy(self), self.request, cleaned_payload) or cleaned_payload
+            cleaned_payloads.append(cleaned_payload)
+
+        insert_many = self._insert_many if self.insert_many_query_stmt is not None else self._insert_one_by_one
+        async with self.request.db.acquire() as conn:
+            async with conn.cursor() as cur:
+                async with self.request.db.transaction(cur):
+                    pks = await insert_many(cur, cleaned_payloads)
+                    if len(pks) != len(cleaned_payloads):
+                        access_msg_context.set({
+                            'query': cur.query.decode()
+                        })
+                        if self.request.session:
+                            raise web.HTTPConflict(
+                                reason='Illegal cross workspace insert or non-existent FK supplied')
+                        raise post_exceptions.CreateFailed()
+
+        if hasattr(self.schema, 'after_post'):
+            async def after_post_many():
+                for cleaned_payload, pk in zip(cleaned_payloads, pks):
+                    await self.schema.after_post(self.request, cleaned_payload, pk)
+            self.request.db.after_commit(after_post_many())
+
+        return json_response({self.pk_column_name: pks})
+
     async def put(self):
         cleaned_select, cleaned_payload = await self._clean_update_payload()
         cleaned_payload = self._clean_write_payload(cleaned_payload)
@@ -153,19 +213,19 @@ class ViewsTemplate:
 
         query = query_with_where.format(updates=','.join(updates))
 
-        async with self.request.app.db_pool.acquire() as conn:
+        async with self.request.db.acquire() as conn:
             async with conn.cursor() as cur:
                 await self.request.app.commons.execute(cur, query, query_values, envelope='payload')
                 res = await cur.fetchone()
                 if not res or not res[0]:
-                    self.request.app.access_logger = self.request.app.access_logger.bind(msg_context={
+                    access_msg_context.set({
                         'query': cur.query.decode()
                     })
                     raise post_exceptions.UpdateFailed()
 
         if hasattr(self.schema, 'after_put'):
-            await spawn(self.request,
-                        self.schema.after_put(self.request, cleaned_select, cleaned_payload, res))
+            self.request.db.after_commit(
+                self.schema.after_put(self.request, cleaned_select, cleaned_payload, res))
 
         return json_response({'updated': res[0]})
 
@@ -197,19 +257,19 @@ class ViewsTemplate:
 
         query = query_with_where.format(updates=','.join(updates))
 
-        async with self.request.app.db_pool.acquire() as conn:
+        async with self.request.db.acquire() as conn:
             async with conn.cursor() as cur:
                 await self.request.app.commons.execute(cur, query, query_values, envelope='payload')
                 res = await cur.fetchone()
                 if not res or not res[0]:
-                    self.request.app.access_logger = self.request.app.access_logger.bind(msg_context={
+                    access_msg_context.set({
                         'query': cur.query.decode()
                     })
                     raise post_exceptions.UpdateFailed()
 
         if hasattr(self.schema, 'after_patch'):
-            await spawn(self.request,
-                        self.schema.after_patch(self.request, cleaned_select, cleaned_payload, res))
+            self.request.db.after_commit(
+                self.schema.after_patch(self.request, cleaned_select, cleaned_payload, res))
 
         return json_response({'updated': res[0]})
 
@@ -252,9 +312,9 @@ class ViewsTemplate:
         deleted_resource_instances = 0
         deleted_m2m_refs = 0
 
-        async with self.request.app.db_pool.acquire() as conn:
+        async with self.request.db.acquire() as conn:
             async with conn.cursor() as cur:
-                async with cur.begin():
+                async with self.request.db.transaction(cur):
                     try:
                         await self.request.app.commons.execute(cur, query, query_values)
                     except Exception as exc:
@@ -265,7 +325,7 @@ class ViewsTemplate:
                     # fetch the query result under the same transaction, before commiting
                     res = await cur.fetchone()
                     if not res or not res[0]:
-                        self.request.app.access_logger = self.request.app.access_logger.bind(msg_context={
+                        access_msg_context.set({
                             'query': cur.query.decode()
                         })
                         raise post_exceptions.DeleteFailed()
@@ -284,19 +344,17 @@ class ViewsTemplate:
                         except Exception as exc:
                             self.request.app.error_logger.exception(
                                 'Failed to execute the deletion of M2M dependencies', query=m2m_query)
-                            await cur.execute('rollback;')
                             raise exc
 
                         res = await cur.fetchone()
                         if not res or not res[0]:
-                            await cur.execute('rollback;')
-                            self.request.app.error_logger.exception(
+                            self.request.app.error_logger.error(
                                 'Failed to delete the resource\'s M2M dependencies', query=m2m_query)
                             raise post_exceptions.DeleteFailed(body="Failed to delete the M2M dependencies")
                         deleted_m2m_refs = res[0]
 
         if hasattr(self.schema, 'after_delete'):
-            await spawn(self.request, self.schema.after_delete(self.request, cleaned_payload, res))
+            self.request.db.after_commit(self.schema.after_delete(self.request, cleaned_payload, res))
 
         return json_response({
             'deleted_resource_records': deleted_resource_instances,
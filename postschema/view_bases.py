@@ -1,12 +1,17 @@
+import asyncio
+import random
+import re
+import time
 import warnings
-import weakref
 
 import orjson
+import psycopg2
 from aiohttp import web
 from cached_property import cached_property
 from collections import deque, defaultdict as dd
 from contextlib import suppress
 from functools import lru_cache
+from hashlib import md5
 from importlib import import_module
 
 from marshmallow import Schema, ValidationError, fields, validate, post_load
@@ -14,7 +19,9 @@ from sqlalchemy.sql.schema import Sequence
 
 from . import exceptions as post_exceptions
 from .auth.clauses import SessionContext
+from .cache import etag_matches, query_digest
 from .commons import MANDATORY_PAGINATION_FIELDS
+from .db import TRANSACTIONAL_OPS
 from .fields import (
     Set, Relationship, AutoImpliedForeignResource,
     AutoSessionField, AutoSessionForeignResource,
@@ -22,13 +29,25 @@ from .fields import (
 )
 from .exceptions import WrongType
 from .hooks import translate_naive_nested, translate_naive_nested_to_dict
-from .schema import DefaultMetaBase
-from .utils import json_response, retype_schema
+from .logging import access_msg_context, request_log_context
+from .timing import timed
+from .schema import ContextualSchemaMixin, DefaultMetaBase, ValidationContext, validation_context
+from .statements import COPY, DROP, EXTENDED, NAMED_PARAM_PAT, POP, SPREAD, WherePlan
+from .utils import decode_cursor, encode_cursor, json_response, retype_schema
 from .validators import must_not_be_empty, adjust_children_field
 
 NESTABLE_FIELDS = (fields.Dict, fields.Nested, Set)
 ITERABLE_FIELDS = (Set, fields.List)
 NON_ITERABLE_FIELDS = (Relationship, TimeRange, RangeDTField)
+PAGINATION_MODES = ('offset', 'cursor')
+COUNT_MODE_PAT = re.compile(r'^(exact|none|estimate|capped:[1-9]\d*)$')
+EXPORT_FORMATS = {
+    'csv': ('FORMAT csv, HEADER true', 'text/csv'),
+    'binary': ('FORMAT binary', 'application/octet-stream')
+}
+EXPORT_QUEUE_SIZE = 16
+# leaves the `json` values unparsed, see `_fetch`
+JSON_TEXT = psycopg2.extensions.new_type((114,), 'JSON_TEXT', lambda value, cur: value)
 
 
 class FormatDict(dict):
@@ -42,7 +61,8 @@ class FallbackString(str):
         return self.format_map(kk)
 
 
-def adjust_pagination_schema(pagination_schema, schema_cls, list_by_fields, pk):
+def adjust_pagination_schema(pagination_schema, schema_cls, list_by_fields, pk, pagination_mode='offset',
+                             count_mode='exact'):
     declared_fields = pagination_schema._declared_fields
     cls_name = pagination_schema.__name__
     MANDATORY_PAGINATION_FIELDS._cls_name = cls_name
@@ -77,6 +97,15 @@ def adjust_pagination_schema(pagination_schema, schema_cls, list_by_fields, pk):
         fields.String(validate=orig_validators),
         missing=missing_val)
 
+    if pagination_mode == 'cursor':
+        # keyset pagination seeks past the last row seen, instead of counting pages
+        pagination_methods.setdefault('cursor', fields.String())
+
+    # how `total_count` is to be computed: exact, none, estimate or capped:<N>
+    pagination_methods.setdefault('count', fields.String(
+        missing=count_mode,
+        validate=validate.Regexp(COUNT_MODE_PAT, error='Should be one of: exact, none, estimate, capped:<N>')))
+
     return type(cls_name, (Schema, ), pagination_methods)
 
 
@@ -134,47 +163,174 @@ def make_write_schema(schema_cls):
     return new_schema_cls
 
 
+def render_list_stream_stmt(tablename, select_stmt):
+    '''Row-per-line `list` variant, fetched off a server-side cursor.
+    Rows come as text, so they can be written out as they are.
+    '''
+    return FallbackString(f'''SELECT json_build_object({select_stmt})::text
+        FROM "{tablename}" {{joins}}
+        WHERE {{where}}
+        ORDER BY {{orderby}} {{orderhow}}
+    ''')
+
+
+def render_list_keyset_stmt(tablename, select_stmt):
+    '''Keyset `list` variant: the seek predicate replaces OFFSET, so that only `limit` rows get read,
+    and the last row's sort key gets carried over to the response as the next page's cursor
+    '''
+    return FallbackString(f'''SELECT json_build_object(
+        'data', coalesce(json_agg(t.js ORDER BY t.rn), '[]'::json),
+        'total_count', {{count}},
+        'next_cursor', (array_agg(t.cur ORDER BY t.rn DESC))[1]
+    ) FROM (
+        SELECT json_build_object({select_stmt}) AS js,
+               json_build_array({{cursor_cols}}) AS cur,
+               row_number() OVER (ORDER BY {{orderby}}) AS rn
+               FROM "{tablename}" {{joins}}
+               WHERE {{where}} {{seek}}
+               ORDER BY {{orderby}}
+               LIMIT {{limit}}
+    ) t
+    ''')
+
+
+def render_list_offset_stmt(tablename, select_stmt):
+    tablename_cte = f'{tablename}_cte'
+    return FallbackString(f'''WITH "{tablename_cte}" AS (
+            SELECT json_build_object({select_stmt}) AS js,
+                   {{count}} AS full_count
+                   FROM "{tablename}" {{joins}}
+                   WHERE {{where}}
+                   ORDER BY {{orderby}} {{orderhow}}
+        )
+        SELECT json_build_object('data', json_agg(js), 'total_count', t.ct) FROM (
+            SELECT js, {tablename_cte}.full_count as ct FROM "{tablename_cte}"
+            LIMIT {{limit}}
+            OFFSET {{offset}}
+        ) t
+        GROUP BY t.ct
+    ''')
+
+
+# `list` query renderers, by streaming/pagination mode
+LIST_STMT_RENDERERS = {
+    'stream': render_list_stream_stmt,
+    'cursor': render_list_keyset_stmt,
+    'offset': render_list_offset_stmt
+}
+
+
+class CopySink:
+    '''File-like target for `cursor.copy_expert`, handing the chunks written
+    by the worker thread over to the event loop through a bounded queue.
+    '''
+
+    def __init__(self, loop, queue):
+        self.loop = loop
+        self.queue = queue
+        self.cancelled = False
+
+    def _put(self, chunk):
+        if self.cancelled:
+            raise IOError('Export cancelled')
+        asyncio.run_coroutine_threadsafe(self.queue.put(chunk), self.loop).result()
+
+    def write(self, chunk):
+        self._put(bytes(chunk))
+
+    def close(self):
+        self._put(None)
+
+
+class CopyProducer:
+    '''Runs `COPY ... TO STDOUT` on a synchronous connection in a worker thread of `executor`,
+    as COPY isn't supported on asynchronous connections. The output is read off with `get()`.
+    '''
+
+    def __init__(self, executor, dsn, query, values, copy_options):
+        loop = asyncio.get_event_loop()
+        self.sink = CopySink(loop, asyncio.Queue(maxsize=EXPORT_QUEUE_SIZE))
+        self.job = loop.run_in_executor(executor, self._copy_to, dsn, query, values, copy_options, self.sink)
+
+    @staticmethod
+    def _copy_to(dsn, query, values, copy_options, sink):
+        conn = psycopg2.connect(dsn)
+        try:
+            with conn.cursor() as cur:
+                # interpolate client-side, COPY doesn't take parameters
+                select = cur.mogrify(query, values).decode()
+                cur.copy_expert(f'COPY ({select}) TO STDOUT WITH ({copy_options})', sink)
+            conn.rollback()
+        finally:
+            conn.close()
+            with suppress(IOError):
+                sink.close()
+
+    async def get(self):
+        '''The next chunk of the output, `None` once it's all out'''
+        return await self.sink.queue.get()
+
+    async def abort(self):
+        '''Unblock the worker thread, so it can abort the COPY, and wait for it to be done'''
+        self.sink.cancelled = True
+        while not self.job.done():
+            with suppress(asyncio.QueueEmpty):
+                self.sink.queue.get_nowait()
+            await asyncio.sleep(0.01)
+
+
 class CommonViewMixin:
 
     @classmethod
-    async def log_request(cls, req, resp):
+    def log_request(cls, req, resp):
+        '''Push the access log record onto `AccessLog`, with the payload as parsed by the view.
+        Whether to log is decided upfront, off `AccessLogging`'s sampling rates and thresholds.
+        '''
         logging_cls = getattr(cls.schema_cls, 'AccessLogging', None)
         if not logging_cls:
             return
 
-        is_authed = req.session.needs_session
-        if not is_authed:
-            pub_logging_conf = getattr(logging_cls, 'public', None)
-            if not pub_logging_conf or req.operation not in pub_logging_conf:
+        rates = logging_cls.authed if req.session.needs_session else logging_cls.public
+        try:
+            rate = rates[req.operation]
+        except KeyError:
+            return
+
+        status = resp.status
+        if status < 400 or not logging_cls.always_log_errors:
+            slow_threshold = logging_cls.slow_threshold.get(req.operation)
+            if slow_threshold is not None and time.monotonic() - req.started_at < slow_threshold:
                 return
-        else:
-            auth_logging_conf = getattr(logging_cls, 'authed', None)
-            if not auth_logging_conf or req.operation not in auth_logging_conf:
+            if rate < 1 and random.random() >= rate:
                 return
 
-        status = resp.status
         if status >= 400:
-            method = 'error'
+            level = 'error'
             txt_resp = str(resp.reason)
         else:
-            txt_resp = str(resp.text)
-            method = 'info'
-
-        txt_resp = str(resp.reason)
-        try:
-            payload = await req.json()
-        except Exception:
-            payload = {}
-        msg = dict(
-            resp=txt_resp[:5000] + '...' if resp.body_length >= 5000 else txt_resp,
-            payload=payload,
-            **req.app.access_logger._context.pop('msg_context', {})
-        )
-        await getattr(req.app.access_logger, method)(
-            msg,
-            status=status,
-            path=req.path,
-            op=req.operation)
+            level = 'info'
+            # streamed responses have no body to excerpt
+            body = getattr(resp, 'body', None)
+            if isinstance(body, bytes):
+                # decode only the excerpt, not the whole (possibly multi-MB) body
+                txt_resp = body[:5000].decode(resp.charset or 'utf-8', 'ignore')
+                if len(body) > 5000:
+                    txt_resp += '...'
+            else:
+                txt_resp = ''
+
+        req.app.commons.access_log.push({
+            **req.app.config.initial_logging_context,
+            **(request_log_context.get() or {}),
+            'level': level,
+            'resp': txt_resp,
+            'payload': getattr(req, 'parsed_payload', None),
+            'status': status,
+            'path': req.path,
+            'op': req.operation,
+            'duration': time.monotonic() - req.started_at,
+            **(access_msg_context.get() or {})
+        })
 
     async def _validate_singular_payload(self, payload=None, schema=None, envelope_key=None,
                                          raise_orig=False):
@@ -185,9 +341,6 @@ class CommonViewMixin:
             warnings.warn("Can't validate payload without body schema")
             return {}
 
-        ref_schema.session = weakref.proxy(self.request.session)
-        ref_schema.app = weakref.proxy(self.request.app)
-
         try:
             autosession_fields = ref_schema._autosession_fields
         except AttributeError:
@@ -196,19 +349,26 @@ class CommonViewMixin:
         self.extend_payload_with_session(payload_used, autosession_fields)
 
         err_msg = None
+        ctx_token = validation_context.set(ValidationContext(self.request))
         try:
-            loaded = ref_schema.load(payload_used)
-        except ValidationError as merr:
-            if raise_orig:
-                raise merr
-            err_msg = merr.messages
-            raise post_exceptions.ValidationError(err_msg if not envelope_key else {envelope_key: err_msg})
-
-        with suppress(AttributeError):
-            # ignore validating \w schemas not inheriting from PostSchema
-            err_msg = await ref_schema.run_async_validators(payload_used) or err_msg
+            try:
+                with timed('load'):
+                    loaded = ref_schema.load(payload_used)
+            except ValidationError as merr:
+                if raise_orig:
+                    raise merr
+                err_msg = merr.messages
+                raise post_exceptions.ValidationError(err_msg if not envelope_key else {envelope_key: err_msg})
+
+            with suppress(AttributeError), timed('validators'):
+                # ignore validating \w schemas not inheriting from PostSchema
+                err_msg = await ref_schema.run_async_validators(payload_used) or err_msg
+        finally:
+            validation_context.reset(ctx_token)
 
         if err_msg:
+            if raise_orig:
+                raise ValidationError(err_msg)
             raise post_exceptions.ValidationError(err_msg if not envelope_key else {envelope_key: err_msg})
 
         return loaded
@@ -254,7 +414,7 @@ class AuxViewMeta(type):
                     schemas[location][k] = methods.get(k)
 
         schemas = {
-            f'{k}_schema': type('PathSchema', (Schema,), v)()
+            f'{k}_schema': type('PathSchema', (ContextualSchemaMixin, Schema), v)()
             for k, v in schemas.items()
         }
 
@@ -336,9 +496,12 @@ class AuxViewBase(web.View, CommonViewMixin):
     async def payload(self):
         '''Refers to JSON payload transmitted in body'''
         try:
-            return await self.request.json(loads=orjson.loads)
+            payload = await self.request.json(loads=orjson.loads)
         except Exception:
             raise web.HTTPBadRequest(reason='cannot read payload')
+        # kept for the access log
+        self.request.parsed_payload = payload
+        return payload
 
     @cached_property
     async def form_payload(self):
@@ -387,6 +550,15 @@ class ViewsClassBase(web.View):
         method = getattr(self, self.request.operation, None)
         if method is None:
             self._raise_allowed_methods()
+        if self.operation in TRANSACTIONAL_OPS and self.request.app.commons.table_versions is not None:
+            # versions get bumped once the request's done with the database.
+            # Linked schemas keep registering their cascades after `post_init`, hence resolved here
+            schema = self.schema_cls
+            self.request.db.written_tables.update([
+                schema.__tablename__,
+                *(foreign_table for _, foreign_table, _ in schema._deletion_cascade),
+                *(foreign_table for foreign_table, *_ in schema._m2m_cherrypicks)
+            ])
         return await method()
 
     @classmethod
@@ -428,6 +600,8 @@ class ViewsClassBase(web.View):
         cls.pk_column_name = pk_name = cls.pk_col.name
         cls.schema_cls.pk_column_name = pk_name
         cls.pk_autoicr = isinstance(cls.pk_col.default, Sequence)
+        # keyset pagination has to handle NULLs in these explicitly
+        cls.nullable_columns = frozenset(name for name, column in table.columns.items() if column.nullable)
 
         schema_metacls = getattr(cls.schema_cls, 'Meta', object)
 
@@ -440,6 +614,11 @@ class ViewsClassBase(web.View):
         cls.schema_cls._special_output_processing = cls._find_special_output_fields()
         cls.schema_cls._join_to_schema_where_stmt = joins
 
+        # tables whose changes invalidate the cached responses
+        tablename = cls.schema_cls.__tablename__
+        cls.read_tables = [tablename, *sorted({join_obj['linked_schema'].__tablename__
+                                               for join_obj in joins.values()} - {tablename})]
+
         try:
             selects_nested_map = cls.schema_cls._nested_select_stmts
         except AttributeError:
@@ -468,11 +647,22 @@ class ViewsClassBase(web.View):
                                   for field in private_list_by}
         private_delete_by = getattr(private_meta, 'delete_by', auth_delete_by)
 
+        cls.cache = getattr(schema_metacls, 'cache', False)
+
         pagination_schema_raw = getattr(schema_metacls, 'pagination_schema', Pagination)
+        cls.pagination_mode = getattr(schema_metacls, 'pagination', 'offset')
+        if cls.pagination_mode not in PAGINATION_MODES:
+            raise ValueError(f'{cls.schema_cls.__name__}.Meta.pagination should be one of: {PAGINATION_MODES}')
+        count_mode = getattr(schema_metacls, 'count', 'exact')
+        if not COUNT_MODE_PAT.match(count_mode):
+            raise ValueError(
+                f'{cls.schema_cls.__name__}.Meta.count should be one of: exact, none, estimate, capped:<N>')
 
         cls.pagination_schema = adjust_pagination_schema(pagination_schema_raw,
                                                          cls.schema_cls, common_order_by,
-                                                         cls.pk_column_name)()
+                                                         cls.pk_column_name,
+                                                         cls.pagination_mode,
+                                                         count_mode)()
         cls.select_schema = make_select_fields_schema(cls.schema_cls)()
 
         excluded = getattr(schema_metacls, 'exclude_from_updates', [])
@@ -484,14 +674,29 @@ class ViewsClassBase(web.View):
         cls.allowed_selectors_variants = {
             'public': {
                 'get_query_stmt': cls._prepare_get_query(public_get_by_select, request_type='public'),
+                # rendered off a copy first, as `_prepare_list_query` pops the joined fields
+                'list_stream_query_stmt': cls._prepare_list_query(
+                    dict(public_list_by_select), request_type='public', streaming=True),
+                'export_query_stmt': cls._prepare_export_query(
+                    dict(public_list_by_select), request_type='public'),
                 'list_query_stmt': cls._prepare_list_query(public_list_by_select, request_type='public')
             },
             'authed': {
                 'get_query_stmt': cls._prepare_get_query(auth_get_by_select, request_type='authed'),
+                # rendered off a copy first, as `_prepare_list_query` pops the joined fields
+                'list_stream_query_stmt': cls._prepare_list_query(
+                    dict(auth_list_by_select), request_type='authed', streaming=True),
+                'export_query_stmt': cls._prepare_export_query(
+                    dict(auth_list_by_select), request_type='authed'),
                 'list_query_stmt': cls._prepare_list_query(auth_list_by_select, request_type='authed')
             },
             'private': {
                 'get_query_stmt': cls._prepare_get_query(private_get_by_select, request_type='private'),
+                # rendered off a copy first, as `_prepare_list_query` pops the joined fields
+                'list_stream_query_stmt': cls._prepare_list_query(
+                    dict(private_list_by_select), request_type='private', streaming=True),
+                'export_query_stmt': cls._prepare_export_query(
+                    dict(private_list_by_select), request_type='private'),
                 'list_query_stmt': cls._prepare_list_query(private_list_by_select, request_type='private')
             }
         }
@@ -536,6 +741,7 @@ class ViewsClassBase(web.View):
         write_schema = make_write_schema(cls.schema_cls)
         cls.post_schema = write_schema(use='write', exclude=read_only_fields,
                                        autosession_fields=autosession_fields)
+        cls.post_many_schema = cls.post_schema
         cls.patch_schema = cls.put_schema = write_schema(use='write', partial=True, exclude=update_excluded)
 
         read_schema = cls.relationize_schema(joins) or cls.schema_cls
@@ -628,7 +834,7 @@ class ViewsClassBase(web.View):
         return include_dict
 
     @classmethod
-    def _prepare_list_query(cls, list_by, compile_selects=False, request_type=None):
+    def _prepare_list_query(cls, list_by, compile_selects=False, request_type=None, streaming=False):
 
         metacls_name = request_type.title()
 
@@ -641,7 +847,6 @@ class ViewsClassBase(web.View):
             )
 
         tablename = cls.schema_cls.__tablename__
-        tablename_cte = f'{tablename}_cte'
         joined_fields = dd(dict)
         extra_fields = {}
 
@@ -689,19 +894,23 @@ class ViewsClassBase(web.View):
 
         # selects = cls._prepare_selects(list_by) if compile_selects else list_by
         # select = ','.join(f"'{k}',{tablename}.{v}" for k, v in selects.items())
-        return FallbackString(f'''WITH "{tablename_cte}" AS (
-                SELECT json_build_object({select_stmt}) AS js,
-                       count(*) OVER() AS full_count
-                       FROM "{tablename}" {{joins}}
-                       WHERE {{where}}
-                       ORDER BY {{orderby}} {{orderhow}}
-            )
-            SELECT json_build_object('data', json_agg(js), 'total_count', t.ct) FROM (
-                SELECT js, {tablename_cte}.full_count as ct FROM "{tablename_cte}"
-                LIMIT {{limit}}
-                OFFSET {{offset}}
-            ) t
-            GROUP BY t.ct
+        return LIST_STMT_RENDERERS['stream' if streaming else cls.pagination_mode](tablename, select_stmt)
+
+    @classmethod
+    def _prepare_export_query(cls, list_by, compile_selects=False, request_type=None):
+        '''Plain column-per-field variant of the list query, to be fed into `COPY`.
+        Joined resources are left out, as they don't map onto flat rows.'''
+        tablename = cls.schema_cls.__tablename__
+        joins_to_schemas = cls.schema_cls._join_to_schema_where_stmt
+        selects = cls._prepare_selects(list_by) if compile_selects else list_by
+        select_stmt = ','.join(
+            f'"{tablename}".{v} AS "{k}"' for k, v in selects.items()
+            if k not in joins_to_schemas and '__' not in k and not isinstance(v, dict)
+        )
+        return FallbackString(f'''SELECT {select_stmt}
+            FROM "{tablename}" {{joins}}
+            WHERE {{where}}
+            ORDER BY {{orderby}} {{orderhow}}
         ''')
 
     @classmethod
@@ -832,6 +1041,8 @@ class ViewsClassBase(web.View):
             cte_members[self_col_name] = f'SELECT {dest_cols} FROM "{dest_tablename}" WHERE "{dest_tablename}".{dest_pk}=%({self_col_name})s'
 
         if cte_members:
+            # multi-row inserts are only rendered for the plain `VALUES` variant
+            cls.insert_many_query_stmt = cls.insert_fixed_values = None
             insert_cols.extendleft(extra_colnames)
             values.extendleft(extra_values)
             cte = ',\n'.join(f'{k}_cte AS ({stmt})' for k, stmt in cte_members.items())
@@ -845,12 +1056,28 @@ class ViewsClassBase(web.View):
                     f'{{on_conflict}} '
                     f'RETURNING {cls.pk_column_name}')
 
+        cls._prepare_insert_many_query(insert_cols, values)
         colnames = ','.join(insert_cols)
         return f"""INSERT INTO "{cls.tablename}" ({colnames}{{cols}})
             VALUES ( {valnames}{{vals}} )
             {{on_conflict}}
             RETURNING {cls.pk_column_name}"""
 
+    @classmethod
+    def _prepare_insert_many_query(cls, insert_cols, values):
+        '''Pre-render the multi-row INSERT used by `post_many`, along with each row's fixed values.
+        Sequence-based primary keys are allocated upfront, see `_preallocate_pks`.
+        '''
+        fixed_values = list(values)
+        if cls.pk_autoicr:
+            fixed_values[-1] = f'%({cls.pk_column_name})s'
+        cls.insert_fixed_values = ','.join(fixed_values)
+        colnames = ','.join(insert_cols)
+        cls.insert_many_query_stmt = f"""INSERT INTO "{cls.tablename}" ({colnames}{{cols}})
+            VALUES {{rows}}
+            {{on_conflict}}
+            RETURNING {cls.pk_column_name}"""
+
     @classmethod
     def _render_associated_delete_stmts(cls):
         this_tablename = cls.schema_cls.__tablename__
@@ -900,9 +1127,12 @@ class ViewsBase(ViewsClassBase, CommonViewMixin):
     @cached_property
     async def payload(self):
         try:
-            return await self.request.json(loads=orjson.loads)
+            payload = await self.request.json(loads=orjson.loads)
         except Exception:
             raise web.HTTPBadRequest(reason='cannot read payload')
+        # kept for the access log
+        self.request.parsed_payload = payload
+        return payload
 
     @property
     def get_schema(self):
@@ -924,6 +1154,18 @@ class ViewsBase(ViewsClassBase, CommonViewMixin):
     def list_query_stmt(self):
         return self.allowed_selectors_variants[self.request_type]['list_query_stmt']
 
+    @property
+    def export_schema(self):
+        return self.list_schema
+
+    @property
+    def export_query_stmt(self):
+        return self.allowed_selectors_variants[self.request_type]['export_query_stmt']
+
+    @property
+    def list_stream_query_stmt(self):
+        return self.allowed_selectors_variants[self.request_type]['list_stream_query_stmt']
+
     @property
     def request(self):
         return self._request
@@ -983,6 +1225,28 @@ class ViewsBase(ViewsClassBase, CommonViewMixin):
 
         return cleaned_select, cleaned_payload
 
+    async def _validate_many_payload(self, payloads):
+        '''Validate each of the bulk-posted `payloads`, reporting the errors by the item's index'''
+        if not isinstance(payloads, list) or not all(isinstance(item, dict) for item in payloads):
+            raise post_exceptions.ValidationError({'payload': ['Expected a list of objects']})
+        if not payloads:
+            raise post_exceptions.ValidationError({'payload': ['Empty payload is not accepted']})
+        bulk_limit = self.schema_cls.Meta.bulk_post_limit
+        if len(payloads) > bulk_limit:
+            raise post_exceptions.ValidationError({
+                'payload': [f'Cannot create more than {bulk_limit} resources at once']})
+
+        loaded = []
+        errors = {}
+        for idx, payload in enumerate(payloads):
+            try:
+                loaded.append(await self._validate_singular_payload(payload=payload, raise_orig=True))
+            except ValidationError as merr:
+                errors[idx] = merr.messages
+        if errors:
+            raise post_exceptions.ValidationError({'payload': errors})
+        return loaded
+
     def _clean_write_payload(self, payload):
         '''Post-validation payload cleaning abstract methods
         used with POST, PUT and PATCH. Primarily to handle the relationships.'''
@@ -999,8 +1263,70 @@ class ViewsBase(ViewsClassBase, CommonViewMixin):
                 self.request.app.error_logger.exception('Session not found or corrupted')
                 raise web.HTTPUnauthorized(reason='Session not found or corrupted')
 
-    async def _fetch(self, cleaned_payload, query):
-        '''Common logic for `get()` and `list()`'''
+    def _etag_precheck(self, query, values, cache_ttl):
+        '''Version the query's result off its tables, if the schema opts in with `Meta.cache`.
+        The data can't have changed until one of the tables gets written to, so the ETag
+        is known before querying, answering a matching `If-None-Match` with a 304 right away.
+        '''
+        table_versions = self.request.app.commons.table_versions
+        if not cache_ttl or table_versions is None:
+            return None, None
+        version_key = table_versions.stamp(self.read_tables, query_digest(query, values))
+        if version_key is None:
+            return None, None
+        # writes made outside of the generated views don't bump the versions,
+        # so the ETag gets renewed every `cache_ttl` seconds nonetheless
+        ttl_bucket = int(time.time() // cache_ttl)
+        etag = f'"{md5(f"{self.request.app.spec_hash}:{version_key}:{ttl_bucket}".encode()).hexdigest()}"'
+        if etag_matches(self.request, etag):
+            raise web.HTTPNotModified(headers={'ETag': etag})
+        return version_key, etag
+
+    async def _cached_body(self, cache_key, etag):
+        '''The response cached under `cache_key`, if any'''
+        body = await self.request.app.commons.response_cache.get(cache_key)
+        if body is not None:
+            return web.Response(text=body, content_type='application/json', headers={'ETag': etag})
+
+    async def _execute_read(self, query, values, passthrough, finalize=None):
+        '''Run the read query, returning either the JSON text built by Postgres (`passthrough`)
+        or the data decoded off it, post-processed by `finalize`
+        '''
+        async with self.request.db.acquire(read=True) as conn:
+            async with conn.cursor() as cur:
+                if passthrough:
+                    psycopg2.extensions.register_type(JSON_TEXT, cur.raw)
+                try:
+                    await self.request.app.commons.run_query(cur, query, values, prepare=True)
+                except Exception:
+                    self.request.app.error_logger.exception('Failed to fetch results',
+                                                            query=cur.query.decode())
+                    raise
+                row = await cur.fetchone()
+                if passthrough:
+                    return '{}' if row is None else row[0] or 'null'
+                data = {} if row is None else row[0]
+                if finalize is not None:
+                    data = await finalize(cur, data)
+                return data
+
+    def _render_body(self, result, passthrough, etag=None):
+        '''Serialize `result`, tagging the response with `etag` or, failing that, a hash of its body'''
+        with timed('serialize'):
+            resp = web.Response(text=result, content_type='application/json') if passthrough \
+                else json_response(result)
+        if etag is None:
+            etag = f'"{md5(resp.body).hexdigest()}"'
+            if etag_matches(self.request, etag):
+                raise web.HTTPNotModified(headers={'ETag': etag})
+        resp.headers['ETag'] = etag
+        return resp
+
+    async def _fetch(self, cleaned_payload, query, extra_values=None, finalize=None):
+        '''Common logic for `get()` and `list()`.
+        `extra_values` get merged into the rendered query's values,
+        `finalize` is an optional coroutine function post-processing the fetched data.
+        '''
 
         try:
             extended_fields = self.schema._extended_fields_values
@@ -1008,19 +1334,266 @@ class ViewsBase(ViewsClassBase, CommonViewMixin):
             extended_fields = {}
 
         query, values = self._whereize_query(cleaned_payload, query, extended_fields)
-        async with self.request.app.db_pool.acquire() as conn:
+        if extra_values:
+            values.update(extra_values)
+
+        commons = self.request.app.commons
+        cache_ttl = self.request.app.config.response_cache_ttl if self.cache is True else self.cache
+        version_key, etag = self._etag_precheck(query, values, cache_ttl)
+
+        cache_key = None
+        if cache_ttl and commons.response_cache is not None:
+            cache_key = version_key
+            resp = await self._cached_body(cache_key, etag)
+            if resp is not None:
+                return resp
+
+        # with nothing to post-process, the JSON built by Postgres goes out as is
+        passthrough = finalize is None and self.request.app.config.json_passthrough
+        result = await self._execute_read(query, values, passthrough, finalize)
+        resp = self._render_body(result, passthrough, etag)
+        if cache_key is not None:
+            await commons.response_cache.set(cache_key, resp.text, cache_ttl)
+        return resp
+
+    async def _stream(self, cleaned_payload, base_stmt, pagination_data):
+        '''Stream the `list` results as NDJSON, fetching them in batches
+        off a server-side cursor, so that memory use doesn't depend on the result's size.
+        Paging doesn't apply, as the stream covers the whole filtered result.
+        '''
+
+        try:
+            extended_fields = self.schema._extended_fields_values
+        except AttributeError:
+            extended_fields = {}
+
+        orderby = ','.join(f'"{self.tablename}".{field}' for field in pagination_data['order_by'])
+        query = base_stmt.format(orderby=orderby, orderhow=pagination_data['order_dir'].upper())
+        query, values = self._whereize_query(cleaned_payload, query, extended_fields)
+        batch_size = self.request.app.config.stream_batch_size
+        resp = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        resp.headers['ETag'] = self.request.app.spec_hash
+
+        async with self.request.db.acquire(read=True) as conn:
             async with conn.cursor() as cur:
-                try:
-                    await cur.execute(query, values)
-                except Exception:
-                    self.request.app.error_logger.exception('Failed to fetch results',
-                                                            query=cur.query.decode())
-                    raise
-                try:
-                    data = (await cur.fetchone())[0]
-                except TypeError:
-                    data = {}
-                return json_response(data)
+                async with self.request.db.transaction(cur):
+                    # cursors are closed when the transaction ends
+                    try:
+                        await cur.execute(f'DECLARE postschema_stream NO SCROLL CURSOR FOR {query}', values)
+                    except Exception:
+                        self.request.app.error_logger.exception('Failed to fetch results',
+                                                                query=cur.query.decode())
+                        raise
+                    await resp.prepare(self.request)
+                    while True:
+                        await cur.execute(f'FETCH {batch_size} FROM postschema_stream')
+                        rows = await cur.fetchall()
+                        if not rows:
+                            break
+                        await resp.write(''.join(f'{row[0]}\n' for row in rows).encode())
+
+        await resp.write_eof()
+        return resp
+
+    async def _copy_export(self, cleaned_payload, query, export_format):
+        '''Pipe the `COPY ... TO STDOUT` output straight to the response, with no Python rows built'''
+
+        try:
+            extended_fields = self.schema._extended_fields_values
+        except AttributeError:
+            extended_fields = {}
+
+        query, values = self._whereize_query(cleaned_payload, query, extended_fields)
+        copy_options, content_type = EXPORT_FORMATS[export_format]
+
+        commons = self.request.app.commons
+        with commons.export_slot():
+            producer = CopyProducer(commons.export_executor, commons.export_dsn(), query, values, copy_options)
+            resp = web.StreamResponse(headers={'Content-Type': content_type})
+            resp.headers['ETag'] = self.request.app.spec_hash
+
+            try:
+                chunk = await producer.get()
+                while chunk is not None:
+                    if not resp.prepared:
+                        await resp.prepare(self.request)
+                    await resp.write(chunk)
+                    chunk = await producer.get()
+            except BaseException:
+                await producer.abort()
+                raise
+
+            try:
+                await producer.job
+            except Exception:
+                self.request.app.error_logger.exception('Failed to export results', query=query)
+                raise
+
+        if not resp.prepared:
+            await resp.prepare(self.request)
+        await resp.write_eof()
+        return resp
+
+    def _prepare_count(self, cleaned_payload, count_mode):
+        '''Return the SQL expression filling the list query's `total_count`,
+        along with an optional coroutine function finalizing its value.
+        - exact: window count over the whole filtered result (requires materializing it),
+          a separate count in cursor mode, where only the page's rows get read
+        - none: no count at all
+        - estimate: planner's row estimate, as reported by EXPLAIN
+        - capped:N: count up to N+1 rows, reported as "N+" when exceeded
+        '''
+        mode, _, arg = count_mode.partition(':')
+        return self._count_handlers[mode](self, cleaned_payload, arg)
+
+    def _exact_count(self, cleaned_payload, arg):
+        if self.pagination_mode == 'cursor':
+            return f'(SELECT count(*) FROM "{self.tablename}" {{joins}} WHERE {{where}})', None
+        return 'count(*) OVER()', None
+
+    def _no_count(self, cleaned_payload, arg):
+        return 'NULL::bigint', None
+
+    def _estimated_count(self, cleaned_payload, arg):
+        try:
+            extended_fields = self.schema._extended_fields_values
+        except AttributeError:
+            extended_fields = {}
+
+        # `_whereize_query` consumes the payload, hence the copy
+        estimate_query, estimate_values = self._whereize_query(
+            dict(cleaned_payload),
+            f'EXPLAIN (FORMAT JSON) SELECT 1 FROM "{self.tablename}" {{joins}} WHERE {{where}}',
+            extended_fields)
+
+        async def finalize(cur, data):
+            if data:
+                await cur.execute(estimate_query, estimate_values)
+                plan = (await cur.fetchone())[0]
+                data['total_count'] = plan[0]['Plan']['Plan Rows']
+            return data
+        return 'NULL::bigint', finalize
+
+    def _capped_count(self, cleaned_payload, arg):
+        cap = int(arg)
+
+        async def finalize(cur, data):
+            if data and data['total_count'] > cap:
+                data['total_count'] = f'{cap}+'
+            return data
+        return (f'(SELECT count(*) FROM (SELECT 1 FROM "{self.tablename}" {{joins}} '
+                f'WHERE {{where}} LIMIT {cap + 1}) _capped)'), finalize
+
+    # `total_count` handlers, by count mode
+    _count_handlers = {
+        'exact': _exact_count,
+        'none': _no_count,
+        'estimate': _estimated_count,
+        'capped': _capped_count
+    }
+
+    @staticmethod
+    def _seek_predicate(seek_cols, nullable, last_values, orderhow, seek_values):
+        '''Predicate selecting the rows past `last_values` in the (`seek_cols`, NULLS LAST) order,
+        filling `seek_values` with its parameters.
+        With no nullable columns it's a plain row comparison, which can use a matching index.
+        '''
+        operator = '<' if orderhow == 'DESC' else '>'
+        placeholders = []
+        for i, val in enumerate(last_values):
+            seek_values[f'cursor_{i}'] = val
+            placeholders.append(f'%(cursor_{i})s')
+
+        if not any(nullable):
+            return f"({','.join(seek_cols)}) {operator} ({','.join(placeholders)})"
+
+        # expanded variant: (c1 past v1) OR (c1 = v1 AND c2 past v2) OR ...
+        # with NULLs sorting last, a NULL is past any value, while nothing is past a NULL
+        alternatives = []
+        equal_so_far = []
+        for col, is_nullable, val, placeholder in zip(seek_cols, nullable, last_values, placeholders):
+            if val is not None:
+                past = f'{col} {operator} {placeholder}'
+                if is_nullable:
+                    past = f'({past} OR {col} IS NULL)'
+                alternatives.append(' AND '.join(equal_so_far + [past]))
+                equal_so_far.append(f'{col} = {placeholder}')
+            else:
+                equal_so_far.append(f'{col} IS NULL')
+        return f"({' OR '.join(f'({alternative})' for alternative in alternatives)})"
+
+    async def _fetch_offset_page(self, cleaned_payload, base_stmt, pagination_data):
+        '''Offset variant of `list()`, the default one'''
+        count_expr, count_finalize = self._prepare_count(cleaned_payload, pagination_data['count'])
+        limit = pagination_data['limit']
+        offset = (pagination_data['page'] - 1) * limit
+        orderby = ','.join(f'"{self.tablename}".{field}' for field in pagination_data['order_by'])
+
+        # keep the paging values out of the query text, so that all pages share the same statement
+        query = base_stmt.format(
+            limit='%(page_limit)s',
+            offset='%(page_offset)s',
+            count=count_expr,
+            orderby=orderby,
+            orderhow=pagination_data['order_dir'].upper())
+
+        return await self._fetch(cleaned_payload, query,
+                                 extra_values={'page_limit': limit, 'page_offset': offset},
+                                 finalize=count_finalize)
+
+    async def _fetch_keyset_page(self, cleaned_payload, base_stmt, pagination_data):
+        '''Keyset (cursor) variant of `list()`.
+        Rows are sought past the sort key carried by the `cursor` rather than skipped with OFFSET.
+        The sort key is made of the `order_by` columns, followed by the primary key as a tie-breaker.
+        '''
+        count_expr, count_finalize = self._prepare_count(cleaned_payload, pagination_data['count'])
+        limit = pagination_data['limit']
+        orderhow = pagination_data['order_dir'].upper()
+        seek_fields = [field for field in pagination_data['order_by'] if field != self.pk_column_name]
+        seek_fields.append(self.pk_column_name)
+        seek_cols = [f'"{self.tablename}".{field}' for field in seek_fields]
+        nullable = [field in self.nullable_columns for field in seek_fields]
+        cursor_cols = ','.join(seek_cols)
+
+        seek = ''
+        seek_values = {}
+        cursor = pagination_data.get('cursor')
+        if cursor:
+            try:
+                last_values = decode_cursor(cursor, len(seek_cols))
+            except ValueError as verr:
+                raise post_exceptions.ValidationError({'query': {'cursor': [str(verr)]}})
+            if last_values[-1] is None:
+                raise post_exceptions.ValidationError({'query': {'cursor': ['Invalid cursor']}})
+            seek = f'AND {self._seek_predicate(seek_cols, nullable, last_values, orderhow, seek_values)}'
+
+        seek_values['page_limit'] = limit
+        query = base_stmt.format(
+            limit='%(page_limit)s',
+            count=count_expr,
+            cursor_cols=cursor_cols,
+            seek=seek,
+            orderby=','.join(f'{col} {orderhow} NULLS LAST' if is_nullable else f'{col} {orderhow}'
+                             for col, is_nullable in zip(seek_cols, nullable)))
+
+        async def finalize(cur, data):
+            if count_finalize is not None:
+                data = await count_finalize(cur, data)
+            if data:
+                last_key = data['next_cursor']
+                # a short page means there's nothing left to seek past
+                data['next_cursor'] = encode_cursor(last_key) \
+                    if last_key and len(data['data']) == limit else None
+            return data
+
+        return await self._fetch(cleaned_payload, query, extra_values=seek_values, finalize=finalize)
+
+    # `list()` variants, by streaming/pagination mode
+    _list_handlers = {
+        'stream': _stream,
+        'cursor': _fetch_keyset_page,
+        'offset': _fetch_offset_page
+    }
 
     async def _parse_select_fields(self, get_query, query_maker=None):
         get_query_raw = self.request.query
@@ -1049,19 +1622,105 @@ class ViewsBase(ViewsClassBase, CommonViewMixin):
         return self.insert_query_stmt.format(cols=cols, vals=vals, on_conflict=on_conflict,
                                              session=self.request.session)
 
-    def _whereize_query(self, cleaned_payload, query, extended_fields, in_delete=False): # noqa
+    def _render_insert_many_query(self, payloads, pks=None, on_conflict=''):
+        '''Render a single multi-row INSERT for `payloads`, returning the query and its values.
+        Each row's values are namespaced by the row's index, columns missing from a row
+        fall back to their defaults. `pks` are the keys allocated for sequence-based primary keys.'''
+        colnames = []
+        for payload in payloads:
+            colnames.extend(colname for colname in payload
+                            if colname not in colnames
+                            and ((colname != self.pk_column_name) or self.has_autopk))
+
+        values = {}
+        rows = []
+        for idx, payload in enumerate(payloads):
+            fixed_vals = NAMED_PARAM_PAT.sub(
+                lambda m: f'%(r{idx}_{m.group(1)})s' if m.group(1) else m.group(0),
+                self.insert_fixed_values)
+            row_vals = []
+            for colname in colnames:
+                if colname in payload:
+                    row_vals.append(f'%(r{idx}_{colname})s')
+                else:
+                    row_vals.append('DEFAULT')
+            values.update((f'r{idx}_{colname}', val) for colname, val in payload.items())
+            if pks is not None:
+                values[f'r{idx}_{self.pk_column_name}'] = pks[idx]
+            rows.append(f"( {','.join(filter(None, [fixed_vals, *row_vals]))} )")
+
+        cols = ','.join(colnames)
+        if cols and self.insert_fixed_values:
+            cols = ',' + cols
+        query = self.insert_many_query_stmt.format(cols=cols, rows=',\n'.join(rows), on_conflict=on_conflict,
+                                                   session=self.request.session)
+        return query, values
+
+    async def _preallocate_pks(self, cur, payloads):
+        '''The keys for the rows of `payloads`, known upfront as RETURNING's order
+        isn't guaranteed to follow the rows': allocated off the sequence or carried by the payloads
+        '''
+        if not self.pk_autoicr:
+            return [payload[self.pk_column_name] for payload in payloads]
+        await cur.execute('SELECT nextval(%s) FROM generate_series(1, %s)',
+                          [self.pk_col.default.name, len(payloads)])
+        return [row[0] for row in await cur.fetchall()]
+
+    async def _insert_many(self, cur, payloads):
+        '''Insert `payloads` with a single multi-row INSERT, returning the keys of the rows inserted'''
+        pks = await self._preallocate_pks(cur, payloads)
+        insert_query, values = self._render_insert_many_query(payloads, pks=pks if self.pk_autoicr else None)
+        await self.request.app.commons.execute(cur, insert_query, values, envelope='payload')
+        return pks if len(await cur.fetchall()) == len(payloads) else []
+
+    async def _insert_one_by_one(self, cur, payloads):
+        '''CTE-based variant of `_insert_many`. These inserts can't be batched,
+        so they're run one by one, in the caller's transaction.
+        '''
+        pks = []
+        for payload in payloads:
+            await self.request.app.commons.execute(
+                cur, self._render_insert_query(payload), payload, envelope='payload')
+            res = await cur.fetchone()
+            if res is not None:
+                pks.append(res[0])
+        return pks
+
+    def _whereize_query(self, cleaned_payload, query, extended_fields, in_delete=False):
+        '''Fill in `query`'s WHERE clause (along with its joins, usings and froms) off `cleaned_payload`,
+        consuming the latter. The SQL only depends on the payload's shape, so it's compiled
+        into a `WherePlan` once per shape and served off `commons.where_plans` afterwards.
+        '''
+        with timed('sql_build'):
+            auth_conditions = self.request.auth_conditions
+            shape = frozenset(
+                (key, bool(val), frozenset(val) if isinstance(val, dict) else None)
+                for key, val in cleaned_payload.items())
+            plan_key = (type(self), self.request_type, self.operation, query, in_delete,
+                        auth_conditions.get('stmt'), auth_conditions.get('has_open_clauses', False),
+                        frozenset(self.tables_to_join), shape)
+            plans = self.request.app.commons.where_plans
+            plan = plans.get(plan_key)
+            if plan is None:
+                plan = self._compile_where_plan(cleaned_payload, query, extended_fields, in_delete)
+                plans.set(plan_key, plan)
+
+            # permission clauses reference the session context by parameters only
+            return plan.extract(cleaned_payload, auth_conditions.get('values'))
+
+    def _compile_where_plan(self, cleaned_payload, query, extended_fields, in_delete=False): # noqa
         in_update = 'UPDATE' in query
         try:
             nested_where_stmts = self.schema._nested_where_stmts
         except AttributeError:
             # only inherited resources will have it
-            nested_where_stmts = []
+            nested_where_stmts = {}
 
         tablename = self.schema.__tablename__
         joins = []
         usings = []
         froms = []  # for updates only
-        values = {}
+        steps = []
 
         wheres = deque()
 
@@ -1069,32 +1728,41 @@ class ViewsBase(ViewsClassBase, CommonViewMixin):
         with suppress(KeyError, TypeError):
             wheres.append(self.request.auth_conditions['stmt'])
 
+        # a key goes to the first step taking it, as the steps pop it off the payload in that order
+        remaining = dict(cleaned_payload)
+
         for nested_field, nested_trans in nested_where_stmts.items():
-            nested_in_payload = cleaned_payload.pop(nested_field, None)
-            if nested_in_payload:
-                values.update({nested_field: nested_in_payload})
+            if remaining.get(nested_field):
+                steps.append((POP, nested_field, nested_field, None))
                 wheres.append(nested_trans)
+            elif nested_field in remaining:
+                steps.append((DROP, nested_field, None, None))
+            remaining.pop(nested_field, None)
 
         for m2m_field, m2m_field_translated in self.schema._m2m_where_stmts.items():
-            relation_in_payload = cleaned_payload.pop(m2m_field, None)
-            if relation_in_payload:
-                values.update({m2m_field: relation_in_payload})
+            if remaining.get(m2m_field):
+                steps.append((POP, m2m_field, m2m_field, None))
                 wheres.append(m2m_field_translated)
+            elif m2m_field in remaining:
+                steps.append((DROP, m2m_field, None, None))
+            remaining.pop(m2m_field, None)
 
         for fk_field, join_obj in self.schema._join_to_schema_where_stmt.items():
             linked_schema = join_obj['linked_schema']
             if fk_field in self.tables_to_join:
                 joins.append(self.schema._joins[fk_field])
                 usings.append(fk_field)
-            fk_in_payload = cleaned_payload.pop(fk_field, None)
+            fk_in_payload = remaining.get(fk_field)
+            if fk_field in remaining:
+                # if <schema>.Meta defines a `default_get_critera` function
+                # which in turn returns an expected FK value, we can ignore this
+                spread = fk_in_payload and isinstance(fk_in_payload, dict)
+                steps.append((SPREAD, fk_field, fk_field, None) if spread else (DROP, fk_field, None, None))
             if fk_in_payload:
                 where_stmt = join_obj['unaliased_comp_query'] if in_update or in_delete else join_obj['aliased_comp_query']
                 with suppress(AttributeError):
-                    # if <schema>.Meta defines a `default_get_critera` function
-                    # which in turn returns an expected FK value, we can ignore this
-                    for key, val in fk_in_payload.items():
+                    for key in fk_in_payload.keys():
                         trans_key = f'{fk_field}_{key}'
-                        values.update({trans_key: val})
                         wheres.append(where_stmt.format(subkey=key, fill=trans_key))
                         if in_delete:
                             wheres.append(f'"{tablename}".{fk_field}={fk_field}.{key}')
@@ -1103,25 +1771,19 @@ class ViewsBase(ViewsClassBase, CommonViewMixin):
                     froms.append(linked_tb_name)
                     pk = linked_schema.pk_column_name
                     wheres.appendleft(f'"{linked_tb_name}".{pk}="{tablename}".{fk_field}')
+            remaining.pop(fk_field, None)
 
-        if not self.request.auth_conditions.get('has_open_clauses', False):
-            for key in cleaned_payload.copy():
+        open_clauses = self.request.auth_conditions.get('has_open_clauses', False)
+        if not open_clauses:
+            for key in remaining:
                 if key in extended_fields:
                     ext_field = extended_fields[key]
                     colname = ext_field[0]
                     wheres.append(ext_field[1].format(fieldname=f'w_{colname}'))
-                    value = cleaned_payload.pop(key)
-                    if isinstance(value, list):
-                        values[f'w_{colname}_lower'] = value[0]
-                        values[f'w_{colname}_upper'] = value[1]
-                    else:
-                        values[f'w_{colname}'] = ext_field[2].format(val=value)
+                    steps.append((EXTENDED, key, f'w_{colname}', ext_field[2]))
                 else:
-                    values[f'w_{key}'] = cleaned_payload[key]
+                    steps.append((COPY, key, f'w_{key}', None))
                     wheres.append(f'"{tablename}".{key}=%(w_{key})s')
-        else:
-            # 
-            values = cleaned_payload
 
         joins = ' '.join(joins)
         using = ','.join(usings)
@@ -1132,4 +1794,5 @@ class ViewsBase(ViewsClassBase, CommonViewMixin):
             froms = f'FROM "{froms}"'
 
         wheres_q = ' AND '.join(wheres) or ' 1=1 '
-        return query.format(where=wheres_q, joins=joins, using=using, froms=froms), values
+        query = query.format(where=wheres_q, joins=joins, using=using, froms=froms)
+        return WherePlan(query, steps, open_clauses)
@@ -54,6 +54,7 @@ class Workspace(PostSchema):
         if await request.app.redis_cli.exists(workspaces_key):
             await request.app.redis_cli.delete(workspaces_key)
             await request.app.redis_cli.sadd(workspaces_key, *new_workspaces)
+        await request.app.commons.invalidate_session(actor_id)
 
     async def before_delete(self, request, payload):
         '''This is to prevent two scenarios:
@@ -65,7 +66,7 @@ class Workspace(PostSchema):
             raise web.HTTPBadRequest(reason="Can't remove the active workspace")
 
         query = 'SELECT COUNT(id) FROM workspace WHERE owner = %s'
-        async with request.app.db_pool.acquire() as conn:
+        async with request.db.acquire() as conn:
             async with conn.cursor() as cur:
                 await cur.execute(query, [request.session.actor_id])
                 ret = await cur.fetchone()
@@ -0,0 +1,48 @@
+'''Per-request cost of verifying a session cookie, with and without `DecryptCache`.
+
+Run with: PYTHONPATH=.. python3 benchmarks/decrypt_cache.py
+'''
+import timeit
+import uuid
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from postschema.commons import DecryptCache
+
+ROUNDS = 100000
+SESSION_TTL = 3600 * 24 * 30
+
+
+def main():
+    fernet = Fernet(Fernet.generate_key())
+    cache = DecryptCache(fernet)
+    # actor ids are uuids, making for ~140 byte cookies
+    token = fernet.encrypt(str(uuid.uuid4()).encode())
+    garbage = b'gAAAAA' + token[6:-8] + b'AAAAAAAA'
+
+    def garbage_uncached():
+        try:
+            fernet.decrypt(garbage, ttl=SESSION_TTL)
+        except InvalidToken:
+            pass
+
+    def garbage_cached():
+        try:
+            cache.decrypt(garbage, ttl=SESSION_TTL)
+        except InvalidToken:
+            pass
+
+    cases = {
+        'fernet': lambda: fernet.decrypt(token, ttl=SESSION_TTL),
+        'cached': lambda: cache.decrypt(token, ttl=SESSION_TTL),
+        'invalid fernet': garbage_uncached,
+        'invalid cached': garbage_cached
+    }
+    print(f'cookie size: {len(token)} bytes')
+    for name, case in cases.items():
+        elapsed = timeit.timeit(case, number=ROUNDS)
+        print(f'{name:>15}: {elapsed / ROUNDS * 1e6:.2f} us/request')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+'''Cost of rendering a typical `list` response, the former `str` based path
+(with the stdlib fallback on types orjson doesn't know of) vs. the bytes based one.
+
+Run with: PYTHONPATH=.. python3 benchmarks/json_response.py
+'''
+import json
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+import orjson
+from aiohttp import web
+from psycopg2.extras import NumericRange
+
+from postschema.utils import ORJSON_FLAGS, def_dump, json_response
+
+ROUNDS = 2000
+PAGE_SIZE = 100
+
+
+def legacy_dumps(val):
+    try:
+        return orjson.dumps(val, option=ORJSON_FLAGS).decode()
+    except orjson.JSONEncodeError:
+        return json.dumps(val, default=def_dump)
+
+
+def legacy_json_response(data):
+    return web.json_response(data, dumps=legacy_dumps)
+
+
+def make_page(**extra):
+    return {
+        'data': [{
+            'id': i,
+            'name': f'Resource {i}',
+            'email': f'resource{i}@example.com',
+            'created': datetime(2020, 1, 1, 12, i % 60).isoformat(),
+            'tags': ['a', 'b', 'c'],
+            'owner': {'id': i * 7, 'name': 'Owner'},
+            **extra
+        } for i in range(PAGE_SIZE)],
+        'total_count': PAGE_SIZE
+    }
+
+
+def main():
+    pages = {
+        'plain': make_page(),
+        'extra types': make_page(price=Decimal('9.99'), roles=frozenset(['Admin', 'Staff']),
+                                 range=NumericRange(1, 10))
+    }
+    for page_name, page in pages.items():
+        for name, render in [('legacy', legacy_json_response), ('bytes', json_response)]:
+            elapsed = timeit.timeit(lambda: render(page), number=ROUNDS)
+            print(f'{page_name:>12} {name:>7}: {elapsed / ROUNDS * 1e6:.2f} us/response')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+'''Per-request cost of `_whereize_query` over the mock schemas' `list` queries,
+compiling the WHERE clause on every call vs. serving it off the plan cache.
+
+Run with: PYTHONPATH=..:mock python3 benchmarks/where_plans.py
+(with the same environment as the test suite, i.e. FERNET_KEY set)
+'''
+import timeit
+
+from aiohttp.test_utils import make_mocked_request
+
+from main import create_app
+from postschema.commons import Commons
+from postschema.statements import PlanCache
+from postschema.view_bases import ViewsBase
+
+ROUNDS = 20000
+
+
+def make_payload(view):
+    payload = {}
+    joins = view.schema_cls._join_to_schema_where_stmt
+    for field in view.list_schema.fields:
+        if field in joins:
+            payload[field] = {joins[field]['target_table']['target_col']: 1}
+        else:
+            payload[field] = 'x'
+    return payload
+
+
+def main():
+    app = create_app()
+    app.commons = Commons(app)
+    views = {route.handler for route in app.router.routes()
+             if isinstance(route.handler, type) and issubclass(route.handler, ViewsBase)}
+
+    cases = []
+    for view_cls in sorted(views, key=lambda view_cls: view_cls.__name__):
+        request = make_mocked_request('POST', '/', headers={'Range': 'list'}, app=app)
+        request.operation = 'list'
+        request.auth_conditions = {}
+        view = view_cls(request)
+        payload = make_payload(view)
+        cases.append((view, view.list_query_stmt, payload))
+
+    def run():
+        for view, query, payload in cases:
+            view._whereize_query(dict(payload), query, getattr(view.schema, '_extended_fields_values', {}))
+
+    print(f'{len(cases)} list queries')
+    for name, plans in [('compiled', PlanCache(0)), ('cached', PlanCache())]:
+        app.commons.where_plans = plans
+        elapsed = timeit.timeit(run, number=ROUNDS)
+        print(f'{name:>10}: {elapsed / ROUNDS / len(cases) * 1e6:.2f} us/request')
+
+
+if __name__ == '__main__':
+    main()
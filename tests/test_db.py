@@ -0,0 +1,120 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INTRANS
+
+from postschema import db
+from postschema.db import RequestDB
+
+
+class Store:
+    '''Rows visible to every connection, i.e. the committed ones'''
+
+    def __init__(self):
+        self.rows = []
+
+
+class Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        pass
+
+    async def execute(self, stmt, params=None):
+        conn = self.conn
+        if stmt == 'BEGIN':
+            conn.status = TRANSACTION_STATUS_INTRANS
+        elif stmt == 'COMMIT':
+            conn.store.rows.extend(conn.pending)
+            conn.pending = []
+            conn.status = TRANSACTION_STATUS_IDLE
+        elif stmt == 'ROLLBACK':
+            conn.pending = []
+            conn.status = TRANSACTION_STATUS_IDLE
+        elif conn.status == TRANSACTION_STATUS_INTRANS:
+            conn.pending.append(params)
+        else:
+            conn.store.rows.append(params)
+
+
+class Connection:
+    def __init__(self, store):
+        self.store = store
+        self.pending = []
+        self.status = TRANSACTION_STATUS_IDLE
+        self.raw = SimpleNamespace(get_transaction_status=lambda: self.status)
+
+    def cursor(self):
+        return Cursor(self)
+
+
+class Pool:
+    def __init__(self, store):
+        self.store = store
+
+    async def acquire(self):
+        return Connection(self.store)
+
+    async def release(self, conn):
+        pass
+
+
+@pytest.fixture
+def spawned(monkeypatch):
+    tasks = []
+
+    async def spawn(request, coro):
+        tasks.append(asyncio.ensure_future(coro))
+
+    monkeypatch.setattr(db, 'spawn', spawn)
+    return tasks
+
+
+def make_request(store):
+    app = SimpleNamespace(db_pool=Pool(store), config=SimpleNamespace(request_transactions=True))
+    return SimpleNamespace(app=app, operation='post')
+
+
+async def insert_row(request_db, row, store, seen):
+    async with request_db.acquire() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute('INSERT', row)
+
+    async def after_post():
+        seen.append(list(store.rows))
+
+    request_db.after_commit(after_post())
+
+
+async def test_after_commit_sees_committed_row(spawned):
+    store = Store()
+    seen = []
+    request_db = RequestDB(make_request(store))
+    await insert_row(request_db, {'id': 1}, store, seen)
+    # not spawned until the request's transaction is over
+    assert not spawned and not store.rows
+
+    await request_db.close(commit=True)
+    await asyncio.gather(*spawned)
+    assert seen == [[{'id': 1}]]
+
+
+async def test_after_commit_dropped_on_rollback(spawned):
+    store = Store()
+    seen = []
+    request_db = RequestDB(make_request(store))
+    await insert_row(request_db, {'id': 1}, store, seen)
+
+    async def on_response_done():
+        seen.append('done')
+
+    request_db.after_close(on_response_done())
+    await request_db.close(commit=False)
+    await asyncio.gather(*spawned)
+    assert store.rows == []
+    assert seen == ['done']